@@ -0,0 +1,11 @@
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2id with OWASP's 46 MiB profile (m=47104 KiB, t=2, p=1).
+    Keeps login/registration hashing well under 500ms per request.
+    """
+    time_cost = 2
+    memory_cost = 47104
+    parallelism = 1
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-16 09:40
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_case_insensitive_duplicate_emails(apps, schema_editor):
+    # Refuse to add the constraint halfway through migrate; which account keeps
+    # a shared email is a decision for an administrator, not the migration
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    duplicates = (
+        CustomUser.objects.exclude(email='')
+        .annotate(email_lower=Lower('email'))
+        .values('email_lower')
+        .annotate(count=Count('id'))
+        .filter(count__gt=1)
+    )
+    conflicts = []
+    for row in duplicates:
+        usernames = CustomUser.objects.annotate(email_lower=Lower('email')).filter(
+            email_lower=row['email_lower']
+        ).values_list('username', flat=True)
+        conflicts.append(f"{row['email_lower']}: {', '.join(usernames)}")
+    if conflicts:
+        raise RuntimeError(
+            "Cannot add user_lower_email_uniq: these emails are shared by several "
+            "accounts when compared case-insensitively. Change or clear all but one "
+            "account's email for each, then run migrate again.\n  " + "\n  ".join(conflicts)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_customuser_user_email_lower_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_insensitive_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), condition=models.Q(('email', ''), _negated=True), name='user_lower_email_uniq'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 
 class CustomUser(AbstractUser):
     phone_number = models.CharField(max_length=15, blank=True, null=True)
@@ -9,5 +10,19 @@ class CustomUser(AbstractUser):
     pan_vat_number = models.CharField(max_length=50, blank=True, null=True, help_text="PAN/VAT Registration Number")
     business_type = models.CharField(max_length=100, blank=True, null=True, help_text="Type of Business")
     
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive email lookups at login
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+        ]
+        constraints = [
+            # Emails are unique regardless of case; blank emails are allowed to repeat
+            models.UniqueConstraint(
+                Lower('email'),
+                name='user_lower_email_uniq',
+                condition=~models.Q(email=''),
+            ),
+        ]
+    
     def __str__(self):
         return self.company_name or self.username
\ No newline at end of file
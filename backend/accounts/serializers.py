@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model, authenticate
 from django.contrib.auth.password_validation import validate_password
-from rest_framework.validators import UniqueValidator
+from django.db.models.functions import Lower
 
 User = get_user_model()
 
@@ -9,10 +9,7 @@ class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only= True)
     confirm_password = serializers.CharField(write_only=True)
 
-    email = serializers.EmailField(
-        required= True,
-        validators= [UniqueValidator(queryset= User.objects.all())]
-    )
+    email = serializers.EmailField(required= True)
 
     class Meta:
         model = User
@@ -22,6 +19,13 @@ class RegisterSerializer(serializers.ModelSerializer):
             "email": {"requried":True},
         }
 
+    def validate_email(self, value):
+        # Compare on LOWER(email) so the check uses user_email_lower_idx and
+        # agrees with the case-insensitive unique constraint
+        if User.objects.annotate(email_lower=Lower("email")).filter(email_lower=value.lower()).exists():
+            raise serializers.ValidationError("This field must be unique.")
+        return value
+
     def validate(self, data):
         if data["password"] != data["confirm_password"]:
             raise serializers.ValidationError({"password" :"Passwords don't match"})
@@ -43,8 +47,8 @@ class RegisterSerializer(serializers.ModelSerializer):
         
         # Automatically add company to vendor CSV for categorization
         if user.company_name and user.business_type:
-            from accounts.utils import add_company_to_vendor_csv
-            add_company_to_vendor_csv(user.company_name, user.business_type)
+            from accounts.utils import schedule_add_company_to_vendor_csv
+            schedule_add_company_to_vendor_csv(user.company_name, user.business_type)
         
         return user
 
@@ -54,6 +58,11 @@ class PublicUserSerializer(serializers.ModelSerializer):
         fields = ["id", "username", "email", "company_name", "pan_vat_number", "business_type", "phone_number", "address"]
         read_only_fields = ["id", "username", "email"]
 
+    def to_representation(self, instance):
+        # Every exposed field is a plain column already loaded on the instance,
+        # so read the values directly instead of binding/serializing each field
+        return {field: getattr(instance, field) for field in self.Meta.fields}
+
 class UserUpdateSerializer(serializers.ModelSerializer):
    class Meta:
         model = User
@@ -71,8 +80,8 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         
         # Automatically add company to vendor CSV for categorization
         if instance.company_name and instance.business_type:
-            from accounts.utils import add_company_to_vendor_csv
-            add_company_to_vendor_csv(instance.company_name, instance.business_type)
+            from accounts.utils import schedule_add_company_to_vendor_csv
+            schedule_add_company_to_vendor_csv(instance.company_name, instance.business_type)
         
         return instance 
 
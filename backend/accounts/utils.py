@@ -1,8 +1,14 @@
 import csv
-import os
-from django.conf import settings
+import threading
+from django.db import transaction
+from bills.vendor_mappings import clear_vendor_mappings_cache, get_vendor_csv_path, load_vendor_mappings
 import logging
 
+try:
+    import fcntl
+except ImportError:  # Windows: appends are not locked
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 def add_company_to_vendor_csv(company_name, business_type):
@@ -12,7 +18,7 @@ def add_company_to_vendor_csv(company_name, business_type):
     if not company_name:
         return False
     
-    csv_path = os.path.join(settings.BASE_DIR, 'data', 'vendor_categories.csv')
+    csv_path = get_vendor_csv_path()
     
     # Map business_type to category
     business_type_to_category = {
@@ -30,26 +36,43 @@ def add_company_to_vendor_csv(company_name, business_type):
     company_lower = company_name.strip().lower()
     
     try:
-        # Check if company already exists in CSV
-        existing_vendors = set()
-        if os.path.exists(csv_path):
-            with open(csv_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    existing_vendors.add(row['vendor'].lower())
-        
-        # If company doesn't exist, add it
-        if company_lower not in existing_vendors:
-            with open(csv_path, 'a', encoding='utf-8', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow([company_lower, category, '0.95'])
-            
-            logger.info(f"Added company '{company_name}' to vendor_categories.csv with category '{category}'")
-            return True
-        else:
+        # Check if company already exists in CSV (cached mappings, O(1) lookup)
+        if company_lower in load_vendor_mappings(csv_path):
             logger.info(f"Company '{company_name}' already exists in vendor_categories.csv")
             return False
+        
+        with open(csv_path, 'a', encoding='utf-8', newline='', buffering=1 << 16) as file:
+            # Serialize concurrent appends so parallel registrations don't interleave rows
+            if fcntl:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            
+            # Re-check under the lock in case another process just added it
+            if company_lower in load_vendor_mappings(csv_path):
+                logger.info(f"Company '{company_name}' already exists in vendor_categories.csv")
+                return False
+            
+            writer = csv.writer(file)
+            writer.writerow([company_lower, category, '0.95'])
+        
+        clear_vendor_mappings_cache()
+        logger.info(f"Added company '{company_name}' to vendor_categories.csv with category '{category}'")
+        return True
             
     except Exception as e:
         logger.error(f"Error adding company to CSV: {e}")
         return False
+
+
+def schedule_add_company_to_vendor_csv(company_name, business_type):
+    """
+    Run add_company_to_vendor_csv in a background thread once the current
+    transaction commits, keeping CSV IO off the request's critical path
+    """
+    def start():
+        threading.Thread(
+            target=add_company_to_vendor_csv,
+            args=(company_name, business_type),
+            daemon=True,
+        ).start()
+
+    transaction.on_commit(start)
@@ -1,5 +1,6 @@
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError
 from django.contrib.auth import authenticate, get_user_model
+from django.db.models.functions import Lower
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -16,6 +17,8 @@ from .serializers import (
 
 User = get_user_model()
 
+_PROFILE_FIELDS = tuple(PublicUserSerializer.Meta.fields)
+
 class RegisterView(APIView):
     permission_classes = [AllowAny]
 
@@ -23,9 +26,9 @@ class RegisterView(APIView):
         serializer = RegisterSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
 
+        # create_user() is a single INSERT, so no explicit transaction/savepoint is needed
         try:
-            with transaction.atomic():
-                user = serializer.save()
+            user = serializer.save()
         except IntegrityError:
             return Response({"message": "Could not create user due to a database error."},
                             status=status.HTTP_400_BAD_REQUEST)
@@ -57,16 +60,28 @@ class LoginView(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
         
-        user = authenticate(request=request, username=username, password=password)
-
-        
-        if not user and "@" in username:
+        # Resolve email logins up front so the password is only hashed once
+        user_obj = None
+        if "@" in username:
             try:
-                user_obj = User.objects.filter(email__iexact=username).first()
-                if user_obj:
-                    user = authenticate(request=request, username=getattr(user_obj, user_obj.USERNAME_FIELD), password=password)
+                # Filter on LOWER(email) so the user_email_lower_idx expression index is used
+                user_obj = (
+                    User.objects.annotate(email_lower=Lower("email"))
+                    .filter(email_lower=username.lower())
+                    .only("id", User.USERNAME_FIELD)
+                    .first()
+                )
             except Exception:
-                user = None
+                user_obj = None
+
+        user = None
+        resolved_username = getattr(user_obj, User.USERNAME_FIELD) if user_obj else None
+        if resolved_username:
+            user = authenticate(request=request, username=resolved_username, password=password)
+        # A literal username containing "@" may belong to a different account
+        # than the one owning that email
+        if not user and resolved_username != username:
+            user = authenticate(request=request, username=username, password=password)
 
         if not user:
             return Response({"message": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
@@ -86,8 +101,9 @@ class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        serializer = PublicUserSerializer(request.user, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Read-only: skip serializer construction and render the public fields directly
+        user = request.user
+        return Response({field: getattr(user, field) for field in _PROFILE_FIELDS}, status=status.HTTP_200_OK)
 
     def put(self, request):
         from .serializers import UserUpdateSerializer
@@ -118,7 +134,8 @@ class LogoutView(APIView):
 
         try:
             token = RefreshToken(refresh_token)
-            token.blacklist()  
+            # Blacklist before responding so the token can't be refreshed after logout
+            token.blacklist()
         except Exception as e:
             return Response({"message": "Invalid or expired token.", "detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
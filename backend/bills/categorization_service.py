@@ -1,22 +1,81 @@
-import csv
-import os
+import functools
 import re
-from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from bills.models import Bill, Category
+from bills.vendor_mappings import load_vendor_index
 import logging
 
+try:
+    import ahocorasick
+except ImportError:  # Fall back to the single-regex keyword matcher
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
+# Fields written back when a bill is auto-categorized
+CATEGORIZATION_FIELDS = ['category', 'is_auto_categorized', 'confidence_score', 'updated_at']
+BULK_UPDATE_BATCH_SIZE = 1000
+
+# Receipts rarely exceed a few KB of OCR text; cap pathological inputs
+MAX_ANALYZED_TEXT_LENGTH = 64 * 1024
+
+
+def build_text_to_analyze(vendor, ocr_text):
+    """
+    Lowercased text used for keyword matching. The vendor is usually already
+    part of the OCR text, so it is only prepended when it isn't.
+    """
+    vendor_lower = (vendor or '').lower().strip()
+    ocr_lower = (ocr_text or '')[:MAX_ANALYZED_TEXT_LENGTH].lower()
+    if vendor_lower and vendor_lower not in ocr_lower:
+        return f"{vendor_lower} {ocr_lower}".strip()
+    return ocr_lower.strip()
+
+@functools.lru_cache(maxsize=1)
+def compile_keyword_matcher(all_keywords):
+    """
+    Build the (automaton, pattern, contains) matcher for a frozenset of keywords.
+    Cached on the keywords themselves, so services created per upload reuse it
+    until a category's keywords change.
+    """
+    # Aho-Corasick reports every (including overlapping) keyword in one
+    # linear pass, so it needs neither the regex nor the containment map
+    if ahocorasick is not None and all_keywords:
+        automaton = ahocorasick.Automaton()
+        for keyword in all_keywords:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+        return automaton, None, {}
+    
+    # A found keyword implies every shorter keyword it contains is present too,
+    # which covers matches hidden behind a longer keyword at the same position
+    keyword_contains = {
+        keyword: [other for other in all_keywords if other != keyword and other in keyword]
+        for keyword in all_keywords
+    }
+    
+    if not all_keywords:
+        return None, None, keyword_contains
+    
+    # Longest first so each position reports its longest keyword; the
+    # lookahead lets overlapping keywords match at every position
+    alternation = '|'.join(
+        re.escape(keyword) for keyword in sorted(all_keywords, key=len, reverse=True)
+    )
+    return None, re.compile(f'(?=({alternation}))'), keyword_contains
+
 class BillCategorizationService:
     def __init__(self, use_ml=True):
         self.use_ml = use_ml
         self.load_vendor_mappings()
+        self.load_categories()
         
         # Initialize ML categorizer
         if self.use_ml:
             try:
-                from bills.ml_categorization import MLBillCategorizer
-                self.ml_categorizer = MLBillCategorizer()
+                from bills.ml_categorization import get_categorizer
+                self.ml_categorizer = get_categorizer()
             except Exception as e:
                 logger.error(f"Error initializing ML categorizer: {e}")
                 self.ml_categorizer = None
@@ -24,28 +83,43 @@ class BillCategorizationService:
             self.ml_categorizer = None
     
     def load_vendor_mappings(self):
-        """Load vendor-category mappings from CSV"""
-        self.vendor_mappings = {}
-        csv_path = os.path.join(settings.BASE_DIR, 'data', 'vendor_categories.csv')
-        
-        if os.path.exists(csv_path):
-            with open(csv_path, 'r') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    vendor = row['vendor'].lower()
-                    category = row['category']
-                    confidence = float(row.get('confidence', 0.9))
-                    self.vendor_mappings[vendor] = {
-                        'category': category,
-                        'confidence': confidence
-                    }
+        """Load vendor-category mappings from CSV (cached until the file changes)"""
+        self.vendor_index = load_vendor_index()
+        self.vendor_mappings = self.vendor_index.mappings
+    
+    def load_categories(self):
+        """Preload categories once so matching doesn't query the database per bill"""
+        categories = list(Category.objects.all())
+        self._categories_by_name = {category.name.lower(): category for category in categories}
+        self._category_keywords = []
+        for category in categories:
+            keywords = tuple(category.get_keywords_list())
+            if keywords:
+                self._category_keywords.append((category, keywords))
+        self.build_keyword_matcher()
+    
+    def build_keyword_matcher(self):
+        """Compile all category keywords into a single matcher scanned once per text"""
+        all_keywords = frozenset(keyword for _, keywords in self._category_keywords for keyword in keywords)
+        self._keyword_automaton, self._keyword_pattern, self._keyword_contains = compile_keyword_matcher(all_keywords)
     
-    def categorize_by_keywords(self, text, vendor=None):
+    def find_keywords(self, text_lower):
+        """Return the set of category keywords present in already-lowercased text"""
+        if self._keyword_automaton is not None:
+            return {keyword for _, keyword in self._keyword_automaton.iter(text_lower)}
+        if not self._keyword_pattern:
+            return set()
+        found = set(self._keyword_pattern.findall(text_lower))
+        for keyword in list(found):
+            found.update(self._keyword_contains[keyword])
+        return found
+    
+    def categorize_by_keywords(self, text, vendor=None, text_is_lower=False):
         """Categorize bill based on vendor CSV mapping and keyword matching"""
         if not text:
             return None, 0.0
         
-        text_lower = text.lower()
+        text_lower = text if text_is_lower else text.lower()
         best_category = None
         best_score = 0.0
         
@@ -54,47 +128,39 @@ class BillCategorizationService:
             vendor_lower = vendor.lower().strip()
             # Check if vendor exists in CSV mappings
             if vendor_lower in self.vendor_mappings:
-                mapping = self.vendor_mappings[vendor_lower]
-                category_name = mapping['category']
-                confidence = mapping['confidence']
+                category_name, confidence = self.vendor_mappings[vendor_lower]
                 
                 # Find category by name
-                try:
-                    category = Category.objects.get(name=category_name)
+                category = self._categories_by_name.get(category_name.lower())
+                if category:
                     logger.info(f"Vendor '{vendor}' matched in CSV to category '{category_name}' with {confidence:.2f} confidence")
                     return category, confidence
-                except Category.DoesNotExist:
-                    logger.warning(f"Category '{category_name}' from CSV not found in database")
+                logger.warning(f"Category '{category_name}' from CSV not found in database")
             
             # Check if vendor contains any keywords from CSV
-            for csv_vendor, mapping in self.vendor_mappings.items():
-                if csv_vendor in vendor_lower or vendor_lower in csv_vendor:
-                    category_name = mapping['category']
-                    confidence = mapping['confidence'] * 0.9  # Slightly lower for partial match
-                    
-                    try:
-                        category = Category.objects.get(name=category_name)
-                        logger.info(f"Vendor '{vendor}' partially matched CSV vendor '{csv_vendor}' to category '{category_name}'")
-                        return category, confidence
-                    except Category.DoesNotExist:
-                        pass
-        
-        # Fallback: Get all categories with keywords
-        categories = Category.objects.exclude(keywords='')
+            for csv_vendor in self.vendor_index.partial_matches(vendor_lower):
+                category_name, confidence = self.vendor_mappings[csv_vendor]
+                confidence = confidence * 0.9  # Slightly lower for partial match
+                
+                category = self._categories_by_name.get(category_name.lower())
+                if category:
+                    logger.info(f"Vendor '{vendor}' partially matched CSV vendor '{csv_vendor}' to category '{category_name}'")
+                    return category, confidence
         
-        for category in categories:
-            keywords = category.get_keywords_list()
+        # Fallback: Score all categories against keywords found in a single scan of the text
+        found_keywords = self.find_keywords(text_lower)
+        
+        for category, keywords in self._category_keywords:
             score = 0.0
             
             for keyword in keywords:
-                if keyword in text_lower:
+                if keyword in found_keywords:
                     # Weight longer keywords higher
                     weight = len(keyword) / 10.0 + 1.0
                     score += weight
             
             # Normalize score by number of keywords
-            if keywords:
-                score = score / len(keywords)
+            score = score / len(keywords)
             
             if score > best_score:
                 best_score = score
@@ -102,20 +168,23 @@ class BillCategorizationService:
         
         return best_category, min(best_score * 0.8, 0.95)  # Cap confidence at 95%
     
-    def categorize_bill(self, bill):
+    def categorize_bill(self, bill, commit=True):
         """
         Main categorization method using hybrid approach:
         1. CSV vendor mapping (highest priority)
         2. ML model prediction (if available)
         3. Keyword matching (fallback)
+        
+        With commit=False the bill is only updated in memory so callers
+        can persist many bills at once via save_categorized_bills().
         """
         category = None
         confidence = 0.0
         method = None
         
         # Try CSV vendor mapping first
-        text_to_analyze = f"{bill.vendor or ''} {bill.ocr_text or ''}".strip()
-        csv_category, csv_confidence = self.categorize_by_keywords(text_to_analyze, vendor=bill.vendor)
+        text_to_analyze = build_text_to_analyze(bill.vendor, bill.ocr_text)
+        csv_category, csv_confidence = self.categorize_by_keywords(text_to_analyze, vendor=bill.vendor, text_is_lower=True)
         
         # If CSV gives high confidence, use it
         if csv_category and csv_confidence > 0.8:
@@ -173,17 +242,29 @@ class BillCategorizationService:
             bill.category = category
             bill.is_auto_categorized = True
             bill.confidence_score = confidence
-            bill.save()
+            if commit:
+                bill.save()
             logger.info(f"Categorized bill {bill.id} as '{category.name}' with confidence {confidence:.2f} using {method}")
         
         return bill
 
+    def save_categorized_bills(self, bills):
+        """Persist categorization results for many bills with batched UPDATEs"""
+        if not bills:
+            return
+        now = timezone.now()
+        for bill in bills:
+            bill.updated_at = now
+        with transaction.atomic():
+            Bill.objects.bulk_update(bills, CATEGORIZATION_FIELDS, batch_size=BULK_UPDATE_BATCH_SIZE)
+
     def bulk_categorize(self, bills):
         """Categorize multiple bills at once"""
         results = []
         for bill in bills:
-            result = self.categorize_bill(bill)
+            result = self.categorize_bill(bill, commit=False)
             results.append(result)
+        self.save_categorized_bills([bill for bill in results if bill.is_auto_categorized])
         return results
 
     def bulk_categorize_bills(self, user=None):
@@ -193,27 +274,43 @@ class BillCategorizationService:
             queryset = queryset.filter(user=user)
         
         categorized_count = 0
-        for bill in queryset:
+        to_update = []
+        # Only the columns categorization reads (vendor/text/ML features) or writes back
+        queryset = queryset.only(
+            'id', 'vendor', 'ocr_text', 'invoice_number', 'amount',
+            'category_id', 'is_auto_categorized', 'confidence_score', 'updated_at',
+        )
+        for bill in queryset.iterator(chunk_size=500):
             try:
-                self.categorize_bill(bill)
+                self.categorize_bill(bill, commit=False)
                 categorized_count += 1
+                if bill.category_id:
+                    to_update.append(bill)
                 logger.info(f"Categorized bill {bill.id}: {bill.category}")
             except Exception as e:
                 logger.error(f"Error categorizing bill {bill.id}: {e}")
+            
+            if len(to_update) >= BULK_UPDATE_BATCH_SIZE:
+                self.save_categorized_bills(to_update)
+                to_update = []
         
+        self.save_categorized_bills(to_update)
         return categorized_count
     
     def train_ml_model(self):
         """Train or retrain the ML categorization model"""
-        if not self.ml_categorizer:
-            try:
-                from bills.ml_categorization import MLBillCategorizer
-                self.ml_categorizer = MLBillCategorizer()
-            except Exception as e:
-                logger.error(f"Error initializing ML categorizer: {e}")
-                return False
+        try:
+            from bills.ml_categorization import MLBillCategorizer, get_categorizer
+            # Train a private instance; the shared one is swapped for the
+            # saved model afterwards so predictions never see a partial state
+            ml_categorizer = MLBillCategorizer()
+        except Exception as e:
+            logger.error(f"Error initializing ML categorizer: {e}")
+            return False
         
-        success = self.ml_categorizer.train_model()
+        success = ml_categorizer.train_model()
+        if success:
+            self.ml_categorizer = get_categorizer()
         return success
         
         return categorized_count
\ No newline at end of file
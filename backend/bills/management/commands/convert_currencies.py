@@ -1,4 +1,6 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Round
 from bills.models import Bill
 from decimal import Decimal
 
@@ -18,17 +20,17 @@ class Command(BaseCommand):
             'INR': Decimal('1.60'),
         }
         
-        bills = Bill.objects.all()
-        updated_count = 0
+        # Resolve each bill's rate in SQL so the whole conversion is one UPDATE
+        rate_case = Case(
+            *[When(currency=currency, then=Value(rate)) for currency, rate in exchange_rates.items()],
+            default=Value(Decimal('1.0000')),
+            output_field=DecimalField(max_digits=10, decimal_places=4),
+        )
         
-        for bill in bills:
-            if bill.amount:
-                # Get exchange rate
-                rate = exchange_rates.get(bill.currency, Decimal('1.0000'))
-                bill.exchange_rate = rate
-                bill.amount_npr = bill.amount * rate
-                bill.save(update_fields=['exchange_rate', 'amount_npr'])
-                updated_count += 1
+        updated_count = Bill.objects.filter(amount__isnull=False).exclude(amount=0).update(
+            exchange_rate=rate_case,
+            amount_npr=Round(F('amount') * rate_case, 2),
+        )
         
         self.stdout.write(
             self.style.SUCCESS(
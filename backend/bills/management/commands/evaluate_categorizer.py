@@ -1,9 +1,11 @@
 from django.core.management.base import BaseCommand
-from bills.ml_categorization import MLBillCategorizer
+from bills.ml_categorization import get_categorizer
 from bills.models import Bill
 from sklearn.metrics import classification_report, confusion_matrix
 import numpy as np
 
+BATCH_SIZE = 1000
+
 class Command(BaseCommand):
     help = 'Evaluate ML categorization model performance'
 
@@ -12,7 +14,7 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS('Evaluating ML Categorization Model'))
         self.stdout.write('=' * 80 + '\n')
         
-        ml_categorizer = MLBillCategorizer()
+        ml_categorizer = get_categorizer()
         
         if not ml_categorizer.model:
             self.stdout.write(
@@ -28,33 +30,48 @@ class Command(BaseCommand):
             is_auto_categorized=False
         )
         
-        if test_bills.count() == 0:
+        if not test_bills.exists():
             self.stdout.write(
                 self.style.ERROR("No manually categorized bills found for evaluation.")
             )
             return
         
-        y_true = []
-        y_pred = []
-        y_confidence = []
+        bill_count = test_bills.count()
+        
+        # Preallocate result arrays; only the first `total` slots get filled
+        y_true = np.empty(bill_count, dtype=object)
+        y_pred = np.empty(bill_count, dtype=object)
+        y_confidence = np.empty(bill_count, dtype=np.float32)
         
-        self.stdout.write(f"Evaluating on {test_bills.count()} bills...\n")
+        self.stdout.write(f"Evaluating on {bill_count} bills...\n")
         
         correct = 0
         total = 0
         
-        for bill in test_bills:
-            true_category = bill.category.name
-            predicted_category, confidence = ml_categorizer.predict_category(bill)
-            
-            if predicted_category:
-                y_true.append(true_category)
-                y_pred.append(predicted_category.name)
-                y_confidence.append(confidence)
-                
-                total += 1
-                if true_category == predicted_category.name:
-                    correct += 1
+        # Only the columns the feature extractor and the label need
+        test_bills = test_bills.select_related('category').only(
+            'vendor', 'ocr_text', 'invoice_number', 'amount', 'category__name'
+        )
+        batch = []
+        for bill in test_bills.iterator(chunk_size=BATCH_SIZE):
+            batch.append(bill)
+            if len(batch) >= BATCH_SIZE:
+                batch_total, batch_correct = self.evaluate_batch(
+                    ml_categorizer, batch, y_true, y_pred, y_confidence, total, bill_count
+                )
+                total += batch_total
+                correct += batch_correct
+                batch = []
+        if batch:
+            batch_total, batch_correct = self.evaluate_batch(
+                ml_categorizer, batch, y_true, y_pred, y_confidence, total, bill_count
+            )
+            total += batch_total
+            correct += batch_correct
+        
+        y_true = y_true[:total]
+        y_pred = y_pred[:total]
+        y_confidence = y_confidence[:total]
         
         # Show results
         self.stdout.write("=" * 80)
@@ -64,7 +81,7 @@ class Command(BaseCommand):
         accuracy = correct / total if total > 0 else 0
         self.stdout.write(f"Overall Accuracy: {accuracy:.2%} ({correct}/{total})\n")
         
-        avg_confidence = np.mean(y_confidence) if y_confidence else 0
+        avg_confidence = float(y_confidence.mean()) if total else 0
         self.stdout.write(f"Average Confidence: {avg_confidence:.2%}\n")
         
         self.stdout.write("\nClassification Report:")
@@ -73,20 +90,32 @@ class Command(BaseCommand):
         
         self.stdout.write("\nConfusion Matrix:")
         self.stdout.write("-" * 80)
-        unique_labels = sorted(set(y_true))
+        unique_labels = sorted(set(y_true.tolist()))
         cm = confusion_matrix(y_true, y_pred, labels=unique_labels)
         
         # Print confusion matrix with labels
         self.stdout.write("\n" + " " * 20 + "Predicted")
-        header = " " * 15
-        for label in unique_labels:
-            header += f"{label[:10]:>12}"
-        self.stdout.write(header)
+        self.stdout.write(" " * 15 + "".join(f"{label[:10]:>12}" for label in unique_labels))
         
-        for i, true_label in enumerate(unique_labels):
-            row = f"{true_label[:15]:15}"
-            for j in range(len(unique_labels)):
-                row += f"{cm[i][j]:>12}"
-            self.stdout.write(row)
+        for true_label, counts in zip(unique_labels, cm):
+            self.stdout.write(f"{true_label[:15]:15}" + "".join(f"{count:>12}" for count in counts))
         
         self.stdout.write("\n" + "=" * 80 + "\n")
+    
+    def evaluate_batch(self, ml_categorizer, bills, y_true, y_pred, y_confidence, offset, capacity):
+        """Predict a batch of bills and record results from offset onwards"""
+        total = 0
+        correct = 0
+        for bill, (predicted_category, confidence) in zip(bills, ml_categorizer.predict_categories(bills)):
+            if offset + total >= capacity:
+                break
+            if predicted_category:
+                true_category = bill.category.name
+                y_true[offset + total] = true_category
+                y_pred[offset + total] = predicted_category.name
+                y_confidence[offset + total] = confidence
+                
+                total += 1
+                if true_category == predicted_category.name:
+                    correct += 1
+        return total, correct
@@ -1,4 +1,6 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Lower, Trim
 from bills.models import Bill
 from accounts.models import CustomUser
 
@@ -9,37 +11,34 @@ class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         fixed_count = 0
         
-        # Get all users
-        users = CustomUser.objects.all()
+        # Only users with a company name can have own-company bills
+        users = CustomUser.objects.exclude(company_name__isnull=True).exclude(company_name='').only('id', 'company_name')
         
-        for user in users:
-            if not user.company_name:
-                continue
+        # Commit all users' fixes together instead of one transaction per UPDATE
+        with transaction.atomic():
+            for user in users.iterator():
+                # Normalize company name for comparison
+                company_normalized = user.company_name.strip().lower()
             
-            # Normalize company name for comparison
-            company_normalized = user.company_name.strip().lower()
-            
-            # Find bills where vendor matches user's company name
-            bills = Bill.objects.filter(user=user)
-            
-            for bill in bills:
-                if bill.vendor:
-                    vendor_normalized = bill.vendor.strip().lower()
-                    
-                    # Check if vendor matches company name
-                    if vendor_normalized == company_normalized or company_normalized in vendor_normalized:
-                        # This is user's own company - should be REVENUE/CREDIT
-                        if bill.transaction_type != 'CREDIT':
-                            bill.transaction_type = 'CREDIT'
-                            bill.account_type = 'REVENUE'
-                            bill.is_debit = False
-                            bill.save(update_fields=['transaction_type', 'account_type', 'is_debit'])
-                            fixed_count += 1
-                            self.stdout.write(
-                                self.style.SUCCESS(
-                                    f'Fixed bill ID {bill.id}: "{bill.vendor}" → REVENUE (CREDIT)'
-                                )
-                            )
+                # Vendor matches user's company name (exact or contains) - this is
+                # user's own company, so it should be REVENUE/CREDIT. One UPDATE per user;
+                # the contains match (LIKE '%...%') can only narrow by user in an index.
+                fixed_count += Bill.objects.filter(
+                    user=user,
+                    vendor__isnull=False,
+                ).exclude(
+                    vendor='',
+                ).exclude(
+                    transaction_type='CREDIT',
+                ).annotate(
+                    vendor_normalized=Lower(Trim('vendor')),
+                ).filter(
+                    vendor_normalized__contains=company_normalized,
+                ).update(
+                    transaction_type='CREDIT',
+                    account_type='REVENUE',
+                    is_debit=False,
+                )
         
         self.stdout.write(
             self.style.SUCCESS(
@@ -1,10 +1,17 @@
 from django.core.management.base import BaseCommand
 from django.db import models
+from django.utils import timezone
 from bills.models import Bill
-from ocr.utils.ocr_processor import extract_text_from_image
-from ocr.utils.excel_handler import save_to_excel
+from bills.tax_ids import extract_tax_id
+from bills.management.output import BufferedWriter
+from bills.management.sharding import add_shard_arguments, filter_shard
+from ocr.utils.excel_handler import ExcelRowWriter
+from ocr.utils.workers import create_ocr_pool, extract_text_with_error
 import os
 
+BATCH_SIZE = 500
+
+
 class Command(BaseCommand):
     help = 'Process existing bills with OCR to extract text'
 
@@ -20,92 +27,162 @@ class Command(BaseCommand):
             help='Limit number of bills to process',
             default=None
         )
+        add_shard_arguments(parser)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of OCR worker processes (defaults to the CPU count)',
+            default=None
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting OCR processing for existing bills...'))
 
+        # Uploads still queued belong to the background worker, and rejected
+        # duplicates must stay empty so find_duplicate never matches them
+        bills = filter_shard(Bill.objects.exclude(processing_status__in=['PENDING', 'DUPLICATE']), options)
+
         # Get bills that need processing
         if options['force']:
-            bills = Bill.objects.all()
-            self.stdout.write(f'Processing ALL {bills.count()} bills (--force enabled)')
+            self.stdout.write('Processing ALL bills (--force enabled)')
         else:
-            bills = Bill.objects.filter(
-                models.Q(extracted_text__isnull=True) | 
-                models.Q(extracted_text='')
+            bills = bills.filter(
+                models.Q(ocr_text__isnull=True) | 
+                models.Q(ocr_text='')
             )
-            self.stdout.write(f'Processing {bills.count()} bills without extracted text')
+            self.stdout.write('Processing bills without extracted text')
 
         if options['limit']:
             bills = bills[:options['limit']]
             self.stdout.write(f'Limited to {options["limit"]} bills')
 
-        processed = 0
-        failed = 0
-        skipped = 0
+        # Stream fixed-size windows with only the columns used below
+        bills = bills.select_related('user').only(
+            'id', 'image', 'ocr_text', 'tax_id', 'created_at', 'user__username'
+        ).iterator(chunk_size=200)
 
-        for bill in bills:
-            try:
-                self.stdout.write(f'Processing Bill {bill.id}: {bill.original_name}')
+        self.output = BufferedWriter(self.stdout)
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.pending = []
+        # One workbook for the whole run instead of rewriting it per bill
+        self.excel = ExcelRowWriter()
+        batch = []
 
-                # Check if file exists
-                if not os.path.exists(bill.file.path):
-                    self.stdout.write(
-                        self.style.WARNING(f'  ⚠️  File not found: {bill.file.path}')
-                    )
-                    skipped += 1
-                    continue
+        # OCR is CPU-bound, so fan it out to worker processes and keep all
+        # database writes on the main process
+        with create_ocr_pool(options['workers']) as executor:
+            for bill in bills:
+                try:
+                    self.output.write(f'Processing Bill {bill.id}: {os.path.basename(bill.image.name)}')
 
-                # Extract text using OCR
-                extracted_text = extract_text_from_image(bill.file.path)
-                
-                if extracted_text and extracted_text.strip():
-                    # Update bill with extracted text
-                    bill.extracted_text = extracted_text.strip()
-                    bill.save()
-
-                    # Save to Excel for record keeping
-                    try:
-                        save_to_excel([{
-                            "Bill ID": bill.id,
-                            "Filename": bill.original_name,
-                            "Text": extracted_text,
-                            "Date": bill.uploaded_at.strftime('%Y-%m-%d'),
-                            "Owner": bill.owner.username
-                        }])
-                    except Exception as excel_error:
-                        self.stdout.write(
-                            self.style.WARNING(f'  ⚠️  Excel save failed: {excel_error}')
+                    # Check if file exists
+                    if not os.path.exists(bill.image.path):
+                        self.output.write(
+                            self.style.WARNING(f'  ⚠️  File not found: {bill.image.path}')
                         )
+                        self.skipped += 1
+                        continue
+                except Exception as e:
+                    self.record_failure(bill, e)
+                    continue
 
-                    self.stdout.write(
-                        self.style.SUCCESS(f'  ✅ Extracted {len(extracted_text)} characters')
-                    )
-                    processed += 1
-                else:
-                    self.stdout.write(
-                        self.style.WARNING(f'  ⚠️  No text extracted from image')
-                    )
-                    bill.extracted_text = "No text found"
-                    bill.save()
-                    skipped += 1
+                batch.append(bill)
+                if len(batch) >= BATCH_SIZE:
+                    self.process_batch(executor, batch)
+                    batch = []
 
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'  ❌ OCR failed: {str(e)}')
-                )
-                bill.extracted_text = f"OCR Error: {str(e)}"
-                bill.save()
-                failed += 1
+            self.process_batch(executor, batch)
+
+        self.save_pending()
+
+        try:
+            self.excel.save()
+        except Exception as excel_error:
+            self.output.write(
+                self.style.WARNING(f'⚠️  Excel save failed: {excel_error}')
+            )
+
+        self.output.flush()
 
         # Summary
         self.stdout.write(self.style.SUCCESS('\n=== OCR Processing Complete ==='))
-        self.stdout.write(f'✅ Successfully processed: {processed}')
-        self.stdout.write(f'⚠️  Skipped: {skipped}')
-        self.stdout.write(f'❌ Failed: {failed}')
-        self.stdout.write(f'📊 Total bills in database: {Bill.objects.count()}')
-        
-        bills_with_text = Bill.objects.filter(
-            extracted_text__isnull=False
-        ).exclude(extracted_text='').exclude(extracted_text='No text found')
-        
-        self.stdout.write(f'📝 Bills with extracted text: {bills_with_text.count()}')
\ No newline at end of file
+        self.stdout.write(f'✅ Successfully processed: {self.processed}')
+        self.stdout.write(f'⚠️  Skipped: {self.skipped}')
+        self.stdout.write(f'❌ Failed: {self.failed}')
+        # Both totals in one pass over the table
+        totals = Bill.objects.aggregate(
+            total=models.Count('id'),
+            with_text=models.Count(
+                'id',
+                filter=models.Q(ocr_text__isnull=False) & ~models.Q(ocr_text__in=['', 'No text found'])
+            ),
+        )
+        self.stdout.write(f'📊 Total bills in database: {totals["total"]}')
+        self.stdout.write(f'📝 Bills with extracted text: {totals["with_text"]}')
+
+    def process_batch(self, executor, bills):
+        """Run OCR for a batch of bills in the worker pool and queue the results"""
+        paths = [bill.image.path for bill in bills]
+        results = executor.map(extract_text_with_error, paths, chunksize=4)
+
+        for bill, (extracted_text, error) in zip(bills, results):
+            if error is not None:
+                self.record_failure(bill, error)
+            elif extracted_text and extracted_text.strip():
+                # Update bill with extracted text
+                bill.ocr_text = extracted_text.strip()
+                # New text can carry a different tax ID; the duplicate check relies on it
+                bill.tax_id = extract_tax_id(bill.ocr_text.upper())
+                self.pending.append(bill)
+
+                # Save to Excel for record keeping
+                try:
+                    self.excel.append({
+                        "Bill ID": bill.id,
+                        "Filename": os.path.basename(bill.image.name),
+                        "Text": extracted_text,
+                        "Date": bill.created_at.strftime('%Y-%m-%d'),
+                        "Owner": bill.user.username
+                    })
+                except Exception as excel_error:
+                    self.output.write(
+                        self.style.WARNING(f'  ⚠️  Excel save failed: {excel_error}')
+                    )
+
+                self.output.write(
+                    self.style.SUCCESS(f'  ✅ Bill {bill.id}: extracted {len(extracted_text)} characters')
+                )
+                self.processed += 1
+            else:
+                self.output.write(
+                    self.style.WARNING(f'  ⚠️  Bill {bill.id}: no text extracted from image')
+                )
+                bill.ocr_text = "No text found"
+                bill.tax_id = None
+                self.pending.append(bill)
+                self.skipped += 1
+
+            if len(self.pending) >= BATCH_SIZE:
+                self.save_pending()
+
+    def record_failure(self, bill, error):
+        """Store the OCR error on the bill and count it as failed"""
+        self.output.write(
+            self.style.ERROR(f'  ❌ Bill {bill.id}: OCR failed: {error}')
+        )
+        bill.ocr_text = f"OCR Error: {error}"
+        bill.tax_id = None
+        self.pending.append(bill)
+        self.failed += 1
+
+    def save_pending(self):
+        """Write extracted text and tax IDs for the queued bills in one bulk UPDATE"""
+        if not self.pending:
+            return
+        now = timezone.now()
+        for bill in self.pending:
+            bill.updated_at = now
+        Bill.objects.bulk_update(self.pending, ['ocr_text', 'tax_id', 'updated_at'], batch_size=BATCH_SIZE)
+        self.pending = []
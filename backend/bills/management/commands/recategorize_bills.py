@@ -1,11 +1,16 @@
 from django.core.management.base import BaseCommand
 from django.db import models
+from django.utils import timezone
 from bills.models import Bill, Category
-from bills.categorization_service import BillCategorizationService
+from bills.management.output import BufferedWriter
+from bills.categorization_service import BillCategorizationService, build_text_to_analyze
 import logging
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 500
+UPDATE_FIELDS = ['category', 'confidence_score', 'is_auto_categorized', 'updated_at']
+
 class Command(BaseCommand):
     help = 'Re-categorize existing bills using updated vendor categories CSV data'
 
@@ -47,8 +52,12 @@ class Command(BaseCommand):
         service = BillCategorizationService()
         self.stdout.write(f'Loaded {len(service.vendor_mappings)} vendor mappings from CSV\n')
 
-        # Get bills to process
-        bills = Bill.objects.all()
+        # Get bills to process, joining the current category so reading its
+        # name doesn't cost a query per bill
+        bills = Bill.objects.select_related('category').only(
+            'id', 'vendor', 'ocr_text', 'category__name',
+            'confidence_score', 'is_auto_categorized', 'updated_at',
+        )
         
         if options['user_id']:
             bills = bills.filter(user_id=options['user_id'])
@@ -67,15 +76,19 @@ class Command(BaseCommand):
         
         total_count = bills.count()
         
+        to_process = total_count
         if options['limit']:
             bills = bills[:options['limit']]
+            to_process = min(total_count, options['limit'])
             self.stdout.write(f'Limited to {options["limit"]} bills')
         
-        self.stdout.write(f'\nTotal bills to process: {bills.count()}\n')
+        self.stdout.write(f'\nTotal bills to process: {to_process}\n')
         
         if options['dry_run']:
             self.stdout.write(self.style.WARNING('DRY RUN MODE - No changes will be saved\n'))
 
+        self.output = BufferedWriter(self.stdout)
+
         # Statistics
         processed = 0
         categorized = 0
@@ -84,17 +97,21 @@ class Command(BaseCommand):
         failed = 0
         
         category_changes = {}
+        to_update = []
+        unchanged_lines = []
+        show_unchanged = options['verbosity'] >= 2
 
-        for bill in bills:
+        for bill in bills.iterator(chunk_size=BATCH_SIZE):
             try:
                 old_category = bill.category.name if bill.category else 'Uncategorized'
                 old_confidence = bill.confidence_score or 0.0
                 
                 # Get category and confidence from vendor or text
-                text_to_analyze = f"{bill.vendor or ''} {bill.ocr_text or ''}".strip()
+                text_to_analyze = build_text_to_analyze(bill.vendor, bill.ocr_text)
                 new_category, new_confidence = service.categorize_by_keywords(
                     text_to_analyze, 
-                    vendor=bill.vendor
+                    vendor=bill.vendor,
+                    text_is_lower=True
                 )
                 
                 if new_category:
@@ -125,7 +142,7 @@ class Command(BaseCommand):
                         else:
                             status = self.style.WARNING('⟳ CHANGED')
                         
-                        self.stdout.write(
+                        self.output.write(
                             f'{status} Bill #{bill.id} | '
                             f'Vendor: {bill.vendor or "N/A":<25} | '
                             f'{old_category:<20} ({old_confidence:.2f}) → '
@@ -137,19 +154,25 @@ class Command(BaseCommand):
                             bill.category = new_category
                             bill.confidence_score = new_confidence
                             bill.is_auto_categorized = True
-                            bill.save(update_fields=['category', 'confidence_score', 'is_auto_categorized', 'updated_at'])
+                            # bulk_update bypasses auto_now, so stamp it here
+                            bill.updated_at = timezone.now()
+                            to_update.append(bill)
+                            if len(to_update) >= BATCH_SIZE:
+                                Bill.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=BATCH_SIZE)
+                                to_update = []
                         
                         categorized += 1
                     else:
                         unchanged += 1
-                        if processed < 10:  # Show first 10 unchanged
-                            self.stdout.write(
+                        # Show first 10 unchanged with -v 2; otherwise only the count
+                        if show_unchanged and processed < 10:
+                            unchanged_lines.append(
                                 f'  - Bill #{bill.id} | '
                                 f'Vendor: {bill.vendor or "N/A":<25} | '
                                 f'Category: {old_category:<20} | No change needed'
                             )
                 else:
-                    self.stdout.write(
+                    self.output.write(
                         self.style.WARNING(
                             f'⚠ Bill #{bill.id} | '
                             f'Vendor: {bill.vendor or "N/A":<25} | '
@@ -160,13 +183,20 @@ class Command(BaseCommand):
                 processed += 1
                 
             except Exception as e:
-                self.stdout.write(
+                self.output.write(
                     self.style.ERROR(
                         f'❌ Bill #{bill.id} | Error: {str(e)}'
                     )
                 )
                 failed += 1
 
+        if to_update:
+            Bill.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=BATCH_SIZE)
+
+        self.output.flush()
+        if unchanged_lines:
+            self.stdout.write('\n'.join(unchanged_lines))
+
         # Summary
         self.stdout.write('\n' + '=' * 80)
         self.stdout.write(self.style.SUCCESS('RE-CATEGORIZATION COMPLETE'))
@@ -0,0 +1,53 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from bills.models import Bill
+from bills.tasks import process_uploaded_bill, schedule_delete_images
+
+
+class Command(BaseCommand):
+    help = (
+        'Finish uploads the in-process worker pool lost on a restart: re-run processing '
+        'for bills stuck in PENDING and remove DUPLICATE bills no client came back for'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--minutes',
+            type=int,
+            help='Only touch bills older than this many minutes, so live uploads are left alone',
+            default=10
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Limit number of pending bills to reprocess',
+            default=None
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['minutes'])
+
+        # Rejected duplicates are normally deleted by the uploading client
+        duplicates = Bill.objects.filter(processing_status='DUPLICATE', updated_at__lt=cutoff)
+        with transaction.atomic():
+            image_names = [name for name in duplicates.values_list('image', flat=True) if name]
+            _, deleted = duplicates.delete()
+            schedule_delete_images(image_names)
+        self.stdout.write(f'Removed {deleted.get(Bill._meta.label, 0)} abandoned duplicate bills')
+
+        pending_ids = Bill.objects.filter(
+            processing_status='PENDING', created_at__lt=cutoff
+        ).order_by('created_at').values_list('id', flat=True)
+        if options['limit']:
+            pending_ids = pending_ids[:options['limit']]
+        pending_ids = list(pending_ids)
+        self.stdout.write(f'Reprocessing {len(pending_ids)} bills stuck in PENDING')
+
+        for bill_id in pending_ids:
+            process_uploaded_bill(bill_id)
+            status = Bill.objects.filter(id=bill_id).values_list('processing_status', flat=True).first()
+            self.stdout.write(f'  Bill ID {bill_id}: {status}')
+
+        self.stdout.write(self.style.SUCCESS('Upload recovery complete'))
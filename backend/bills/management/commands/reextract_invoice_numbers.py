@@ -1,10 +1,17 @@
 from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from bills.models import Bill
+from bills.tax_ids import extract_tax_id
+from bills.management.output import BufferedWriter
+from bills.management.sharding import add_shard_arguments, filter_shard
 from ocr.utils.ocr_processor import extract_invoice_number
 import logging
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 500
+
 class Command(BaseCommand):
     help = 'Re-extract invoice numbers from existing bills OCR text'
 
@@ -20,33 +27,43 @@ class Command(BaseCommand):
             help='Limit number of bills to process',
             default=None
         )
+        add_shard_arguments(parser)
 
     def handle(self, *args, **options):
         self.stdout.write('=' * 80)
         self.stdout.write(self.style.SUCCESS('Re-extracting Invoice Numbers'))
         self.stdout.write('=' * 80)
         
+        # Uploads still queued belong to the background worker, and rejected
+        # duplicates must stay empty so find_duplicate never matches them
+        bills = filter_shard(Bill.objects.exclude(processing_status__in=['PENDING', 'DUPLICATE']), options)
+
         # Get bills to process
         if options['force']:
-            bills = Bill.objects.all()
-            self.stdout.write(f'Processing ALL {bills.count()} bills (--force enabled)')
+            total_count = bills.count()
+            self.stdout.write(f'Processing ALL {total_count} bills (--force enabled)')
         else:
             # Only process bills without invoice numbers
-            bills = Bill.objects.filter(invoice_number__isnull=True) | Bill.objects.filter(invoice_number='')
-            self.stdout.write(f'Processing {bills.count()} bills without invoice numbers')
+            bills = bills.filter(Q(invoice_number__isnull=True) | Q(invoice_number=''))
+            total_count = bills.count()
+            self.stdout.write(f'Processing {total_count} bills without invoice numbers')
         
+        # Counted once above; the sliced queryset is never counted again
         if options['limit']:
             bills = bills[:options['limit']]
-            self.stdout.write(f'Limited to {options["limit"]} bills\n')
+            self.stdout.write(f'Limited to {min(total_count, options["limit"])} of {total_count} bills\n')
         
+        self.output = BufferedWriter(self.stdout)
         processed = 0
         updated = 0
         failed = 0
+        to_update = []
         
-        for bill in bills:
+        bills = bills.only('id', 'ocr_text', 'invoice_number', 'vendor', 'tax_id')
+        for bill in bills.iterator(chunk_size=BATCH_SIZE):
             try:
                 if not bill.ocr_text:
-                    self.stdout.write(
+                    self.output.write(
                         self.style.WARNING(
                             f'⚠ Bill #{bill.id} | No OCR text | Skipped'
                         )
@@ -60,9 +77,17 @@ class Command(BaseCommand):
                 
                 if invoice_number:
                     bill.invoice_number = invoice_number
-                    bill.save(update_fields=['invoice_number'])
+                    # Keep the tax ID in step so the duplicate check covers this bill
+                    bill.tax_id = extract_tax_id(bill.ocr_text.upper())
+                    to_update.append(bill)
+                    if len(to_update) >= BATCH_SIZE:
+                        conflicts = self.save_invoice_numbers(to_update)
+                        processed -= conflicts
+                        updated -= conflicts
+                        failed += conflicts
+                        to_update = []
                     
-                    self.stdout.write(
+                    self.output.write(
                         self.style.SUCCESS(
                             f'✓ Bill #{bill.id} | '
                             f'Vendor: {bill.vendor or "N/A":<25} | '
@@ -71,7 +96,7 @@ class Command(BaseCommand):
                     )
                     updated += 1
                 else:
-                    self.stdout.write(
+                    self.output.write(
                         f'  Bill #{bill.id} | '
                         f'Vendor: {bill.vendor or "N/A":<25} | '
                         f'No invoice number found in OCR text'
@@ -80,13 +105,21 @@ class Command(BaseCommand):
                 processed += 1
                 
             except Exception as e:
-                self.stdout.write(
+                self.output.write(
                     self.style.ERROR(
                         f'❌ Bill #{bill.id} | Error: {str(e)}'
                     )
                 )
                 failed += 1
         
+        if to_update:
+            conflicts = self.save_invoice_numbers(to_update)
+            processed -= conflicts
+            updated -= conflicts
+            failed += conflicts
+        
+        self.output.flush()
+
         # Summary
         self.stdout.write('\n' + '=' * 80)
         self.stdout.write(self.style.SUCCESS('RE-EXTRACTION COMPLETE'))
@@ -95,3 +128,29 @@ class Command(BaseCommand):
         self.stdout.write(f'Successfully updated: {updated}')
         self.stdout.write(f'Failed: {failed}')
         self.stdout.write('=' * 80 + '\n')
+
+    def save_invoice_numbers(self, bills):
+        """Bulk update invoice numbers and tax IDs, falling back to per-bill saves on conflicts"""
+        try:
+            with transaction.atomic():
+                Bill.objects.bulk_update(bills, ['invoice_number', 'tax_id'], batch_size=BATCH_SIZE)
+            return 0
+        except IntegrityError:
+            pass
+
+        # One outer transaction for the batch; a savepoint per bill lets a
+        # conflicting row roll back on its own
+        failed = 0
+        with transaction.atomic():
+            for bill in bills:
+                try:
+                    with transaction.atomic():
+                        Bill.objects.filter(pk=bill.pk).update(invoice_number=bill.invoice_number, tax_id=bill.tax_id)
+                except IntegrityError as e:
+                    self.output.write(
+                        self.style.ERROR(
+                            f'❌ Bill #{bill.id} | Error: {str(e)}'
+                        )
+                    )
+                    failed += 1
+        return failed
@@ -18,20 +18,25 @@ class Command(BaseCommand):
             ('Other', 'OTHER', '', '#BDC3C7'),
         ]
         
+        # One query to find what exists, one INSERT for everything missing
+        names = [name for name, *_ in default_categories]
+        existing = set(Category.objects.filter(name__in=names).values_list('name', flat=True))
+        
+        to_create = []
         for name, category_type, keywords, color in default_categories:
-            category, created = Category.objects.get_or_create(
-                name=name,
-                defaults={
-                    'type': category_type,
-                    'keywords': keywords,
-                    'color': color,
-                    'description': f'Default {name} category'
-                }
-            )
-            if created:
-                self.stdout.write(f'Created category: {name}')
-            else:
+            if name in existing:
                 self.stdout.write(f'Category already exists: {name}')
+            else:
+                to_create.append(Category(
+                    name=name,
+                    type=category_type,
+                    keywords=keywords,
+                    color=color,
+                    description=f'Default {name} category'
+                ))
+                self.stdout.write(f'Created category: {name}')
+        
+        Category.objects.bulk_create(to_create, ignore_conflicts=True)
         
         self.stdout.write(
             self.style.SUCCESS('Successfully setup default categories!')
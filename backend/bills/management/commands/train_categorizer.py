@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Count
 from bills.categorization_service import BillCategorizationService
 from bills.models import Bill
 import logging
@@ -29,7 +30,13 @@ class Command(BaseCommand):
             is_auto_categorized=False
         )
         
-        count = manually_categorized.count()
+        # One grouped query gives both the distribution and the total
+        categories = list(
+            manually_categorized.values('category__name').annotate(
+                count=Count('id')
+            ).order_by('-count')
+        )
+        count = sum(cat['count'] for cat in categories)
         self.stdout.write(f'Found {count} manually categorized bills for training\n')
         
         if count < min_samples:
@@ -48,14 +55,9 @@ class Command(BaseCommand):
             return
         
         # Show category distribution
-        self.stdout.write('Category distribution:')
-        from django.db.models import Count
-        categories = manually_categorized.values('category__name').annotate(
-            count=Count('id')
-        ).order_by('-count')
-        
-        for cat in categories:
-            self.stdout.write(f"  {cat['category__name']}: {cat['count']} bills")
+        lines = ['Category distribution:']
+        lines.extend(f"  {cat['category__name']}: {cat['count']} bills" for cat in categories)
+        self.stdout.write('\n'.join(lines))
         
         self.stdout.write('\n' + '-' * 80)
         self.stdout.write('Starting training...\n')
@@ -75,8 +77,10 @@ class Command(BaseCommand):
                 self.stdout.write("\nTop 10 features for categorization:")
                 features = service.ml_categorizer.get_feature_importance(top_n=10)
                 if features:
-                    for i, (feature, importance) in enumerate(features, 1):
-                        self.stdout.write(f"  {i}. {feature}: {importance:.4f}")
+                    self.stdout.write('\n'.join(
+                        f"  {i}. {feature}: {importance:.4f}"
+                        for i, (feature, importance) in enumerate(features, 1)
+                    ))
             
             self.stdout.write('\n' + '=' * 80)
             self.stdout.write('Model is ready to use for bill categorization!')
@@ -1,11 +1,17 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Q
 from bills.models import Bill
-from ocr.utils.ocr_processor import process_bill_image
+from bills.management.output import BufferedWriter
+from bills.management.sharding import add_shard_arguments, filter_shard
+from ocr.utils.workers import create_ocr_pool, extract_line_items_with_error
 import os
 import logging
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 500
+
+
 class Command(BaseCommand):
     help = 'Update line_items for existing bills by re-processing OCR'
 
@@ -21,82 +27,131 @@ class Command(BaseCommand):
             help='Limit number of bills to process',
             default=None
         )
+        add_shard_arguments(parser)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of OCR worker processes (defaults to the CPU count)',
+            default=None
+        )
 
     def handle(self, *args, **options):
         self.stdout.write('=' * 80)
         self.stdout.write(self.style.SUCCESS('Updating Line Items for Bills'))
         self.stdout.write('=' * 80)
         
+        # Uploads still queued belong to the background worker, and rejected
+        # duplicates must stay empty so find_duplicate never matches them
+        bills = filter_shard(Bill.objects.exclude(processing_status__in=['PENDING', 'DUPLICATE']), options)
+
         # Get bills to process
         if options['force']:
-            bills = Bill.objects.all()
-            self.stdout.write(f'Processing ALL {bills.count()} bills (--force enabled)')
+            total_count = bills.count()
+            self.stdout.write(f'Processing ALL {total_count} bills (--force enabled)')
         else:
             # Only process bills without line items
-            bills = Bill.objects.filter(line_items=[])
-            self.stdout.write(f'Processing {bills.count()} bills without line items')
+            bills = bills.filter(Q(line_items=[]) | Q(line_items__isnull=True))
+            total_count = bills.count()
+            self.stdout.write(f'Processing {total_count} bills without line items')
         
+        # Counted once above; the sliced queryset is never counted again
         if options['limit']:
             bills = bills[:options['limit']]
-            self.stdout.write(f'Limited to {options["limit"]} bills\n')
+            self.stdout.write(f'Limited to {min(total_count, options["limit"])} of {total_count} bills\n')
+        
+        self.output = BufferedWriter(self.stdout)
+        self.processed = 0
+        self.updated = 0
+        self.skipped = 0
+        self.failed = 0
+        self.to_update = []
+        batch = []
         
-        processed = 0
-        updated = 0
-        skipped = 0
-        failed = 0
+        bills = bills.only('id', 'vendor', 'image')
         
-        for bill in bills:
-            try:
-                # Check if image file exists
-                if not bill.image or not os.path.exists(bill.image.path):
-                    self.stdout.write(
-                        self.style.WARNING(
-                            f'⚠ Bill #{bill.id} | No image file found | Skipped'
+        # Re-running OCR is CPU-bound, so it is spread over worker processes
+        # while the database writes stay on the main process
+        with create_ocr_pool(options['workers']) as executor:
+            for bill in bills.iterator(chunk_size=200):
+                try:
+                    # Check if image file exists
+                    if not bill.image or not os.path.exists(bill.image.path):
+                        self.output.write(
+                            self.style.WARNING(
+                                f'⚠ Bill #{bill.id} | No image file found | Skipped'
+                            )
                         )
-                    )
-                    skipped += 1
+                        self.skipped += 1
+                        continue
+                except Exception as e:
+                    self.report_failure(bill, e)
                     continue
                 
-                # Re-process the bill image
-                bill_data = process_bill_image(bill.image.path)
-                line_items = bill_data.get('line_items', [])
-                
-                if line_items:
-                    bill.line_items = line_items
-                    bill.save(update_fields=['line_items'])
-                    
-                    self.stdout.write(
-                        self.style.SUCCESS(
-                            f'✓ Bill #{bill.id} | '
-                            f'Vendor: {bill.vendor or "N/A":<25} | '
-                            f'Extracted {len(line_items)} items'
-                        )
-                    )
-                    updated += 1
-                else:
-                    self.stdout.write(
-                        f'  Bill #{bill.id} | '
-                        f'Vendor: {bill.vendor or "N/A":<25} | '
-                        f'No line items found'
-                    )
-                    skipped += 1
-                
-                processed += 1
-                
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(
-                        f'❌ Bill #{bill.id} | Error: {str(e)}'
-                    )
-                )
-                failed += 1
+                batch.append(bill)
+                if len(batch) >= BATCH_SIZE:
+                    self.process_batch(executor, batch)
+                    batch = []
+            
+            self.process_batch(executor, batch)
+        
+        self.save_line_items()
         
+        self.output.flush()
+
         # Summary
         self.stdout.write('\n' + '=' * 80)
         self.stdout.write(self.style.SUCCESS('UPDATE COMPLETE'))
         self.stdout.write('=' * 80)
-        self.stdout.write(f'Total bills processed: {processed}')
-        self.stdout.write(f'Successfully updated: {updated}')
-        self.stdout.write(f'Skipped (no items found): {skipped}')
-        self.stdout.write(f'Failed: {failed}')
+        self.stdout.write(f'Total bills processed: {self.processed}')
+        self.stdout.write(f'Successfully updated: {self.updated}')
+        self.stdout.write(f'Skipped (no items found): {self.skipped}')
+        self.stdout.write(f'Failed: {self.failed}')
         self.stdout.write('=' * 80 + '\n')
+
+    def process_batch(self, executor, bills):
+        """Re-run OCR for a batch of bills in the worker pool and queue the results"""
+        paths = [bill.image.path for bill in bills]
+        results = executor.map(extract_line_items_with_error, paths, chunksize=2)
+        
+        for bill, (line_items, error) in zip(bills, results):
+            if error is not None:
+                self.report_failure(bill, error)
+            elif line_items:
+                bill.line_items = line_items
+                self.to_update.append(bill)
+                
+                self.output.write(
+                    self.style.SUCCESS(
+                        f'✓ Bill #{bill.id} | '
+                        f'Vendor: {bill.vendor or "N/A":<25} | '
+                        f'Extracted {len(line_items)} items'
+                    )
+                )
+                self.updated += 1
+                self.processed += 1
+            else:
+                self.output.write(
+                    f'  Bill #{bill.id} | '
+                    f'Vendor: {bill.vendor or "N/A":<25} | '
+                    f'No line items found'
+                )
+                self.skipped += 1
+                self.processed += 1
+            
+            if len(self.to_update) >= BATCH_SIZE:
+                self.save_line_items()
+
+    def report_failure(self, bill, error):
+        """Report a bill that could not be re-processed"""
+        self.output.write(
+            self.style.ERROR(
+                f'❌ Bill #{bill.id} | Error: {error}'
+            )
+        )
+        self.failed += 1
+
+    def save_line_items(self):
+        """Write the queued line items in one bulk UPDATE"""
+        if self.to_update:
+            Bill.objects.bulk_update(self.to_update, ['line_items'], batch_size=BATCH_SIZE)
+            self.to_update = []
@@ -0,0 +1,17 @@
+class BufferedWriter:
+    """Collect per-bill output lines and write them to a command's stdout in blocks"""
+
+    def __init__(self, stdout, flush_every=500):
+        self.stdout = stdout
+        self.flush_every = flush_every
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.stdout.write('\n'.join(self.lines))
+            self.lines = []
@@ -0,0 +1,29 @@
+from django.core.management.base import CommandError
+from django.db.models.functions import Mod
+
+
+def add_shard_arguments(parser):
+    """Add --shards/--shard so a per-bill command can be split across processes or machines"""
+    parser.add_argument(
+        '--shards',
+        type=int,
+        default=1,
+        help='Split bills into this many shards by ID (default: 1 = no sharding)',
+    )
+    parser.add_argument(
+        '--shard',
+        type=int,
+        default=0,
+        help='Which shard (0-based) this run processes',
+    )
+
+
+def filter_shard(bills, options):
+    """Limit a bill queryset to the shard selected by --shards/--shard"""
+    shards = options['shards']
+    shard = options['shard']
+    if shards < 1 or not 0 <= shard < shards:
+        raise CommandError(f'--shard must be between 0 and {shards - 1} (got {shard})')
+    if shards == 1:
+        return bills
+    return bills.annotate(shard_key=Mod('id', shards)).filter(shard_key=shard)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-16 10:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0009_add_bs_date_support'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['is_auto_categorized', 'category'], name='bill_cat_training_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-16 11:20
+
+from django.db import migrations, models
+
+
+def populate_vendor_lower(apps, schema_editor):
+    # Lowercase in Python to match Bill.save; SQLite's LOWER() only folds ASCII
+    Bill = apps.get_model('bills', 'Bill')
+    batch = []
+    for bill in Bill.objects.exclude(vendor__isnull=True).only('id', 'vendor').iterator(chunk_size=1000):
+        bill.vendor_lower = bill.vendor.lower()
+        batch.append(bill)
+        if len(batch) >= 1000:
+            Bill.objects.bulk_update(batch, ['vendor_lower'])
+            batch = []
+    if batch:
+        Bill.objects.bulk_update(batch, ['vendor_lower'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0011_bill_bill_cat_training_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='vendor_lower',
+            field=models.CharField(blank=True, editable=False, help_text='Lowercased vendor, kept in sync on save for ML training', max_length=255, null=True),
+        ),
+        migrations.RunPython(populate_vendor_lower, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0012_bill_vendor_lower'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='processing_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')], default='COMPLETED', help_text='Background OCR state of an uploaded bill', max_length=10),
+        ),
+    ]
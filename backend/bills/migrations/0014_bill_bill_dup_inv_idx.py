@@ -0,0 +1,20 @@
+# Generated by Django 5.2.7 on 2026-10-16 12:30
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0013_bill_processing_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(models.F('user'), django.db.models.functions.text.Lower('invoice_number'), django.db.models.functions.text.Lower('vendor'), name='bill_dup_inv_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-16 13:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0014_bill_bill_dup_inv_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, help_text='BLAKE2b digest of the uploaded image', max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['user', 'image_hash'], name='bill_user_image_hash_idx'),
+        ),
+    ]
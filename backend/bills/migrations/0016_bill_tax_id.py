@@ -0,0 +1,76 @@
+# Generated by Django 5.2.7 on 2026-10-16 13:45
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copy of bills.tax_ids as of this migration, so later edits to the
+# live patterns don't change what the backfill did
+TAX_ID_PATTERNS = [re.compile(pattern) for pattern in (
+    # Nepal
+    r'(?:PAN\s*(?:number|no\.?|#)?)[:\s]*([0-9]{9})',  # PAN: 9 digits
+    r'(?:VAT\s*(?:number|no\.?|#)?)[:\s]*([0-9]{13})',  # VAT: 13 digits
+    r'(?:PN|VN|TIN)[:\s#]*([0-9]{7,13})',  # Generic Nepal
+
+    # India
+    r'(?:PAN)[:\s#]*([A-Z]{5}[0-9]{4}[A-Z])',  # PAN: ABCDE1234F
+    r'(?:GSTIN?)[:\s#]*([0-9]{2}[A-Z]{5}[0-9]{4}[A-Z][0-9][A-Z][0-9])',  # GSTIN: 15 chars
+
+    # Australia
+    r'(?:ABN)[:\s#]*([0-9]{11})',  # ABN: 11 digits
+    r'(?:ACN)[:\s#]*([0-9]{9})',  # ACN: 9 digits
+
+    # USA
+    r'(?:SSN)[:\s#]*([0-9]{3}[\-]?[0-9]{2}[\-]?[0-9]{4})',  # SSN: 123-45-6789
+    r'(?:EIN)[:\s#]*([0-9]{2}[\-]?[0-9]{7})',  # EIN: 12-3456789
+    r'(?:ITIN)[:\s#]*([9][0-9]{2}[\-]?[7][0-9][\-]?[0-9]{4})',  # ITIN: 9XX-7X-XXXX
+
+    # European Union
+    r'(?:VAT|Tax\s*ID)[:\s#]*(DE[0-9]{9})',  # Germany
+    r'(?:VAT|Tax\s*ID)[:\s#]*(FR[A-Z0-9]{2}[0-9]{9})',  # France
+    r'(?:VAT|Tax\s*ID)[:\s#]*(GB[0-9]{9})',  # UK
+    r'(?:VAT|Tax\s*ID)[:\s#]*(IT[0-9]{11})',  # Italy
+    r'(?:VAT|Tax\s*ID)[:\s#]*(ES[A-Z0-9][0-9]{7}[A-Z0-9])',  # Spain
+    r'(?:VAT|Tax\s*ID)[:\s#]*([A-Z]{2}[A-Z0-9]{8,12})',  # Generic EU VAT
+)]
+TAX_ID_SEPARATORS_RE = re.compile(r'[\s\-]')
+
+
+def extract_tax_id(text_upper):
+    for pattern in TAX_ID_PATTERNS:
+        match = pattern.search(text_upper)
+        if match:
+            return TAX_ID_SEPARATORS_RE.sub('', match.group(1))
+    return None
+
+
+def populate_tax_id(apps, schema_editor):
+    # Same extraction the upload pipeline now stores, so duplicate checks
+    # against existing bills keep working
+    Bill = apps.get_model('bills', 'Bill')
+    batch = []
+    for bill in Bill.objects.exclude(ocr_text='').only('id', 'ocr_text').iterator(chunk_size=1000):
+        bill.tax_id = extract_tax_id(bill.ocr_text.upper())
+        if bill.tax_id:
+            batch.append(bill)
+        if len(batch) >= 1000:
+            Bill.objects.bulk_update(batch, ['tax_id'])
+            batch = []
+    if batch:
+        Bill.objects.bulk_update(batch, ['tax_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0015_bill_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='tax_id',
+            field=models.CharField(blank=True, editable=False, help_text='PAN/VAT or other tax ID extracted from the OCR text', max_length=20, null=True),
+        ),
+        migrations.RunPython(populate_tax_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-16 14:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0016_bill_tax_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['user', 'vendor', 'amount'], name='bill_user_vendor_amount_idx'),
+        ),
+    ]
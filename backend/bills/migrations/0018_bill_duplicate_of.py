@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-16 14:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bills', '0017_bill_bill_user_vendor_amount_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Existing bill this upload was rejected as a duplicate of', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='bills.bill'),
+        ),
+        migrations.AlterField(
+            model_name='bill',
+            name='processing_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('DUPLICATE', 'Duplicate')], default='COMPLETED', help_text='Background OCR state of an uploaded bill', max_length=10),
+        ),
+    ]
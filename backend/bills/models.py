@@ -1,5 +1,6 @@
 
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from accounts.models import CustomUser
 import json
@@ -50,6 +51,13 @@ class Bill(models.Model):
         ('CREDIT', 'Credit (Income/Revenue)'),
     ]
     
+    PROCESSING_STATUS_CHOICES = [
+        ('PENDING', 'Pending'),
+        ('COMPLETED', 'Completed'),
+        ('FAILED', 'Failed'),
+        ('DUPLICATE', 'Duplicate'),
+    ]
+    
     ACCOUNT_TYPE_CHOICES = [
         ('EXPENSE', 'Expense'),
         ('REVENUE', 'Revenue'),
@@ -64,6 +72,7 @@ class Bill(models.Model):
     # Enhanced fields
     invoice_number = models.CharField(max_length=100, blank=True, null=True, db_index=True, help_text="Invoice/Bill number")
     vendor = models.CharField(max_length=255, blank=True, null=True)
+    vendor_lower = models.CharField(max_length=255, blank=True, null=True, editable=False, help_text="Lowercased vendor, kept in sync on save for ML training")
     amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     tax_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default='NPR')
@@ -98,6 +107,23 @@ class Bill(models.Model):
     # Original fields
     ocr_text = models.TextField(blank=True)
     line_items = models.JSONField(default=list, blank=True, help_text="List of items/goods in the bill")
+    tax_id = models.CharField(max_length=20, blank=True, null=True, editable=False, help_text="PAN/VAT or other tax ID extracted from the OCR text")
+    image_hash = models.CharField(max_length=32, blank=True, null=True, editable=False, help_text="BLAKE2b digest of the uploaded image")
+    processing_status = models.CharField(
+        max_length=10,
+        choices=PROCESSING_STATUS_CHOICES,
+        default='COMPLETED',
+        help_text="Background OCR state of an uploaded bill"
+    )
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        help_text="Existing bill this upload was rejected as a duplicate of"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -122,6 +148,14 @@ class Bill(models.Model):
         indexes = [
             models.Index(fields=['user', 'invoice_number', 'vendor']),
             models.Index(fields=['user', 'bill_date']),
+            # Manually categorized bills, scanned when training the ML categorizer
+            models.Index(fields=['is_auto_categorized', 'category'], name='bill_cat_training_idx'),
+            # Case-insensitive duplicate check on upload (invoice number, then vendor)
+            models.Index('user', Lower('invoice_number'), Lower('vendor'), name='bill_dup_inv_idx'),
+            # Byte-identical re-upload check
+            models.Index(fields=['user', 'image_hash'], name='bill_user_image_hash_idx'),
+            # Top vendors: groups by vendor in index order and reads amount from the index
+            models.Index(fields=['user', 'vendor', 'amount'], name='bill_user_vendor_amount_idx'),
         ]
     
     def __str__(self):
@@ -148,6 +182,8 @@ class Bill(models.Model):
     
     def save(self, *args, **kwargs):
         """Auto-classify transaction and convert currency to NPR"""
+        self.vendor_lower = self.vendor.lower() if self.vendor else self.vendor
+        
         # Convert to NPR if currency is different
         if self.amount and self.currency:
             self.exchange_rate = self.get_exchange_rate(self.currency, self.bill_date)
@@ -0,0 +1,368 @@
+import hashlib
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from accounts.models import CustomUser
+from .models import Bill
+from .tax_ids import TAX_ID_SEPARATORS_RE, extract_tax_id
+from ocr.utils.ocr_processor import process_bill_image_bytes
+
+try:
+    import ahocorasick
+except ImportError:  # Fall back to one substring scan per marker
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+# Currency markers, matched as plain substrings of the lowercased OCR text
+NPR_MARKERS = frozenset({'npr', 'nepali', 'chitwan', 'kathmandu'})
+INR_MARKERS = frozenset({'₹', 'inr', 'gst'})  # "gst" also covers "gstin"
+CURRENCY_MARKERS = NPR_MARKERS | INR_MARKERS | {'rupee', 'rs.', 'ps.', '$', 'usd', '€', 'eur', '£', 'gbp'}
+
+
+def build_currency_automaton():
+    """Aho-Corasick automaton over CURRENCY_MARKERS, or None without pyahocorasick"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for marker in CURRENCY_MARKERS:
+        automaton.add_word(marker, marker)
+    automaton.make_automaton()
+    return automaton
+
+
+CURRENCY_AUTOMATON = build_currency_automaton()
+
+BUSINESS_SUFFIXES_RE = re.compile(r'\s*(pvt\.?|ltd\.?|limited|private|inc\.?|llc|corp\.?|corporation|co\.?)\s*', re.IGNORECASE)
+
+# Columns the pipeline writes, including the ones Bill.save() derives
+# (vendor_lower, exchange_rate, amount_npr) and the auto_now updated_at
+PROCESSED_FIELDS = [
+    'ocr_text', 'invoice_number', 'vendor', 'vendor_lower', 'amount', 'tax_amount',
+    'bill_date', 'line_items', 'currency', 'exchange_rate', 'amount_npr',
+    'category', 'is_auto_categorized', 'confidence_score',
+    'transaction_type', 'account_type', 'is_debit',
+    'tax_id', 'image_hash', 'processing_status', 'updated_at',
+]
+FAILED_FIELDS = ['ocr_text', 'image_hash', 'processing_status', 'updated_at']
+# A rejected duplicate keeps none of its OCR data, so it never counts towards totals
+DUPLICATE_FIELDS = ['image_hash', 'duplicate_of', 'processing_status', 'updated_at']
+
+# OCR results are cached by image content hash for a day
+OCR_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Bounded pool so a burst of uploads can't run unlimited Tesseract processes at once
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BILL_PROCESSING_WORKERS', 2),
+    thread_name_prefix='bill-processing',
+)
+
+
+def process_uploaded_bill(bill_id):
+    """Run OCR, duplicate detection and categorization for an uploaded bill"""
+    try:
+        instance = Bill.objects.select_related('user').get(pk=bill_id)
+    except Bill.DoesNotExist:
+        logger.warning(f"Bill ID {bill_id} was deleted before processing")
+        return
+    user = instance.user
+
+    # Process OCR and extract data
+    try:
+        # Read the upload once; hashing and OCR both work from memory
+        with open(instance.image.path, 'rb') as f:
+            image_bytes = f.read()
+        instance.image_hash = image_digest([image_bytes])
+
+        # A byte-identical copy of an already processed bill is a duplicate
+        # no matter what OCR would extract
+        duplicate = Bill.objects.filter(
+            user=user,
+            image_hash=instance.image_hash,
+            processing_status='COMPLETED'
+        ).exclude(id=instance.id).only('id').first()
+        if duplicate:
+            logger.warning(f"Duplicate bill detected for user {user.username}: same image as bill ID {duplicate.id}")
+            mark_duplicate(instance, duplicate)
+            return
+
+        # Identical images (re-uploads, retries) reuse the earlier OCR result
+        cache_key = f'ocr:{instance.image_hash}'
+        bill_data = cache.get(cache_key)
+        if bill_data is None:
+            logger.info(f"Starting OCR processing for bill ID: {instance.id}")
+            bill_data = process_bill_image_bytes(image_bytes, instance.image.name)
+            logger.info(f"OCR completed. Extracted text length: {len(bill_data.get('ocr_text', ''))}")
+            cache.set(cache_key, bill_data, OCR_CACHE_TIMEOUT)
+        else:
+            logger.info(f"Reusing cached OCR result for bill ID: {instance.id}")
+
+        # Update instance with extracted data
+        instance.ocr_text = bill_data.get('ocr_text', '')
+        instance.invoice_number = bill_data.get('invoice_number')
+        instance.vendor = bill_data.get('vendor')
+        instance.amount = bill_data.get('amount')
+        instance.tax_amount = bill_data.get('tax_amount')
+        instance.bill_date = bill_data.get('bill_date')
+        instance.line_items = bill_data.get('line_items', [])
+
+        # Extract PAN/VAT/Tax ID number from OCR text
+        ocr_text_upper = instance.ocr_text.upper() if instance.ocr_text else ''
+        instance.tax_id = extract_tax_id(ocr_text_upper) if ocr_text_upper else None
+        if instance.tax_id:
+            logger.info(f"Extracted Tax ID from bill: {instance.tax_id}")
+
+        # Log if duplicate check was limited
+        if instance.invoice_number and not instance.vendor:
+            # Invoice number extracted but vendor not found
+            logger.warning(
+                f"Invoice number '{instance.invoice_number}' extracted but vendor not identified. "
+                f"Limited duplicate check applied."
+            )
+        elif not instance.invoice_number and not instance.amount:
+            # Neither invoice number nor amount available
+            logger.info(
+                f"Incomplete bill data for duplicate check. Bill will be accepted."
+            )
+
+        # Detect currency from OCR text
+        currency = detect_currency(bill_data.get('ocr_text', '').lower())
+        if currency:
+            instance.currency = currency
+
+        # Auto-categorize the bill
+        from bills.categorization_service import BillCategorizationService, build_text_to_analyze
+
+        # Try categorization based on vendor and OCR text; with neither there is
+        # nothing to match, so don't build the service at all
+        text_to_analyze = build_text_to_analyze(instance.vendor, instance.ocr_text)
+        if text_to_analyze:
+            categorization_service = BillCategorizationService()
+            category, confidence = categorization_service.categorize_by_keywords(text_to_analyze, vendor=instance.vendor, text_is_lower=True)
+        else:
+            category, confidence = None, 0.0
+
+        if category and confidence > 0.3:  # Minimum confidence threshold
+            instance.category = category
+            instance.is_auto_categorized = True
+            instance.confidence_score = confidence
+            logger.info(f"Auto-categorized bill as '{category.name}' with confidence {confidence:.2f}")
+
+        # Determine if this is user's company bill (income) or external vendor bill (expense)
+        is_own_company = False
+        match_reason = None
+
+        # Method 1: Check if vendor name matches user's company name
+        if instance.vendor and user.company_name:
+            vendor_normalized = instance.vendor.strip().lower()
+            company_normalized = user.company_name.strip().lower()
+
+            # Skip if vendor contains common invoice recipient indicators
+            # These phrases indicate this is who the invoice was issued TO, not issued BY
+            recipient_indicators = [
+                'issued to', 'bill to', 'billed to', 'sold to', 
+                'customer', 'client', 'attention', 'attn'
+            ]
+            skip_matching = any(indicator in vendor_normalized for indicator in recipient_indicators)
+
+            if not skip_matching:
+                # Remove common business suffixes for better matching
+                vendor_clean = BUSINESS_SUFFIXES_RE.sub('', vendor_normalized).strip()
+                company_clean = BUSINESS_SUFFIXES_RE.sub('', company_normalized).strip()
+
+                # Require minimum length to avoid false positives
+                min_match_length = 5
+
+                # Check for exact match or strong partial match
+                if len(company_clean) >= min_match_length:
+                    if (vendor_normalized == company_normalized or 
+                        vendor_clean == company_clean or
+                        (vendor_normalized.startswith(company_normalized) and len(company_normalized) >= min_match_length) or
+                        (company_normalized.startswith(vendor_normalized) and len(vendor_normalized) >= min_match_length)):
+                        is_own_company = True
+                        match_reason = f"vendor name '{instance.vendor}' matches company '{user.company_name}'"
+                        logger.info(f"INCOME DETECTED: {match_reason}")
+
+        # Method 2: Check if PAN/VAT number appears in OCR text (fallback when vendor not extracted)
+        if not is_own_company and user.pan_vat_number and ocr_text_upper:
+            # Normalize PAN/VAT number (remove spaces, hyphens, convert to uppercase)
+            pan_vat_normalized = TAX_ID_SEPARATORS_RE.sub('', user.pan_vat_number.strip().upper())
+
+            # Use word boundaries to prevent matching PAN/VAT inside account numbers or other digits
+            # Look for PAN/VAT with context clues like labels (PAN:, VAT:, TIN:, etc.)
+            pan_vat_patterns = [
+                # With explicit labels (most reliable)
+                rf'(?:PAN|VAT|TIN|TAX\s*ID|REGISTRATION)\s*(?:NO\.?|NUMBER|#)?\s*[:\-]?\s*{re.escape(pan_vat_normalized)}',
+                # Standalone with word boundaries (stricter - requires minimum 9 digits to avoid false positives)
+                rf'\b{re.escape(pan_vat_normalized)}\b' if len(pan_vat_normalized) >= 9 else None,
+            ]
+
+            # Remove None patterns and search
+            pan_vat_patterns = [p for p in pan_vat_patterns if p]
+            for pattern in pan_vat_patterns:
+                if re.search(pattern, ocr_text_upper):
+                    is_own_company = True
+                    match_reason = f"PAN/VAT '{user.pan_vat_number}' found in bill"
+                    logger.info(f"INCOME DETECTED: PAN/VAT number '{user.pan_vat_number}' detected in OCR text - bill belongs to user's company")
+                    break
+
+        # Set transaction type based on ownership - THIS IS CRITICAL
+        if is_own_company:
+            # This is income - bill issued by user's own company
+            instance.transaction_type = 'CREDIT'
+            instance.account_type = 'REVENUE'
+            instance.is_debit = False
+            logger.info(f"✓ Bill identified as user's company invoice ({match_reason}) - marked as REVENUE (CREDIT)")
+        else:
+            # This is an expense - bill from external vendor
+            instance.transaction_type = 'DEBIT'
+            instance.account_type = 'EXPENSE'
+            instance.is_debit = True
+            if instance.vendor:
+                logger.info(f"Bill vendor '{instance.vendor}' is external - marked as EXPENSE (DEBIT)")
+            else:
+                logger.info(f"Bill marked as EXPENSE (DEBIT) - no vendor/PAN match found")
+
+        instance.processing_status = 'COMPLETED'
+        try:
+            with transaction.atomic():
+                # Lock the user's row so their concurrent uploads can't both pass
+                # the duplicate check before either is saved
+                CustomUser.objects.select_for_update().only('id').get(pk=user.pk)
+                duplicate = find_duplicate(instance)
+                if duplicate is None:
+                    instance.save(update_fields=PROCESSED_FIELDS)
+        except IntegrityError:
+            # Backstop for databases without row locks (SQLite ignores FOR UPDATE)
+            logger.warning(f"Duplicate bill detected for user {user.username} on save: bill ID {instance.id}")
+            mark_duplicate(instance, find_duplicate(instance))
+            return
+
+        # If duplicate found, reject the upload; the polling client reads the
+        # status and deletes the bill once it has told the user
+        if duplicate is not None:
+            logger.info(f"Rejecting bill ID {instance.id}, duplicate of bill ID {duplicate.id}")
+            mark_duplicate(instance, duplicate)
+            return
+
+    except Exception as e:
+        logger.error(f"OCR processing failed for bill ID {instance.id}: {str(e)}")
+        # Don't lose the upload if OCR fails
+        instance.ocr_text = f"OCR Error: {str(e)}"
+        instance.processing_status = 'FAILED'
+        instance.save(update_fields=FAILED_FIELDS)
+
+
+def image_digest(chunks):
+    """Hex BLAKE2b digest stored as Bill.image_hash for the given file contents"""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_duplicate(instance):
+    """Return an existing bill of the same user that this upload duplicates, or None"""
+    if not instance.invoice_number:
+        return None
+
+    # Same invoice number from the same vendor, or from the same business under
+    # a different vendor name (matched by tax ID). Both share the user/invoice
+    # prefix of bill_dup_inv_idx, so this is one indexed lookup.
+    same_source = Q()
+    if instance.vendor:
+        same_source |= Q(vendor_normalized=instance.vendor.strip().lower())
+    if instance.tax_id:
+        same_source |= Q(tax_id=instance.tax_id)
+    if not same_source:
+        return None
+
+    # Compare on LOWER() so the lookup uses bill_dup_inv_idx; __iexact
+    # compiles to LIKE/UPPER(), which no index covers
+    duplicate = Bill.objects.annotate(
+        invoice_normalized=Lower('invoice_number'),
+        vendor_normalized=Lower('vendor'),
+    ).filter(
+        same_source,
+        user=instance.user,
+        invoice_normalized=instance.invoice_number.strip().lower(),
+        processing_status='COMPLETED',
+    ).exclude(id=instance.id).only('id').first()
+    if duplicate:
+        logger.warning(
+            f"Duplicate bill detected for user {instance.user.username}: "
+            f"Invoice #{instance.invoice_number} from {instance.vendor or instance.tax_id}"
+        )
+
+    # Allow multiple bills from same PAN/VAT as long as invoice numbers are different
+    # This handles the case where same business issues multiple bills
+    return duplicate
+
+
+def detect_currency(ocr_text):
+    """Guess the bill currency from lowercased OCR text, or None"""
+    # One pass collects every marker present, overlapping ones included
+    if CURRENCY_AUTOMATON is not None:
+        found = {marker for _, marker in CURRENCY_AUTOMATON.iter(ocr_text)}
+    else:
+        found = {marker for marker in CURRENCY_MARKERS if marker in ocr_text}
+    # Check for NPR first (more specific indicators)
+    if found & NPR_MARKERS or {'rs.', 'ps.'} <= found:
+        return 'NPR'
+    if found & INR_MARKERS:
+        return 'INR'
+    if found & {'rupee', 'rs.'}:
+        # Generic rupee - default to INR unless other indicators
+        return 'INR'
+    if found & {'$', 'usd'}:
+        return 'USD'
+    if found & {'€', 'eur'}:
+        return 'EUR'
+    if found & {'£', 'gbp'}:
+        return 'GBP'
+    return None
+
+
+def mark_duplicate(instance, duplicate):
+    """Keep a rejected upload as DUPLICATE so the client can learn why it was rejected"""
+    instance.processing_status = 'DUPLICATE'
+    instance.duplicate_of = duplicate
+    instance.save(update_fields=DUPLICATE_FIELDS)
+
+
+def schedule_process_uploaded_bill(bill_id):
+    """
+    Queue process_uploaded_bill on the worker pool once the current
+    transaction commits, keeping OCR off the request's critical path
+    """
+    def run():
+        try:
+            process_uploaded_bill(bill_id)
+        except Exception as e:
+            logger.error(f"Background processing failed for bill ID {bill_id}: {e}")
+        finally:
+            # Worker threads hold their own DB connections
+            close_old_connections()
+
+    transaction.on_commit(lambda: _executor.submit(run))
+
+
+def delete_images(image_names):
+    """Remove stored bill images by name, logging any that can't be deleted"""
+    storage = Bill._meta.get_field('image').storage
+    for name in image_names:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            logger.error(f"Failed to delete image {name}: {e}")
+
+
+def schedule_delete_images(image_names):
+    """Delete image files on the worker pool once the rows' deletion commits"""
+    if image_names:
+        transaction.on_commit(lambda: _executor.submit(delete_images, image_names))
@@ -0,0 +1,133 @@
+import bisect
+import csv
+import functools
+import heapq
+import os
+from types import MappingProxyType
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIDENCE = 0.9
+
+
+def get_vendor_csv_path():
+    """Location of the vendor -> category mapping CSV"""
+    return os.path.join(settings.BASE_DIR, 'data', 'vendor_categories.csv')
+
+
+@functools.lru_cache(maxsize=4)
+def _load_mappings(path, mtime_ns):
+    """
+    Parse the vendor CSV into a read-only dict mapping lowercase vendor to a
+    (category, confidence) tuple. mtime_ns is part of the cache key so edits
+    to the file are picked up.
+    """
+    mappings = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # Skip header
+        for row in reader:
+            if len(row) == 3:
+                vendor, category, confidence = row
+                mappings[vendor.lower()] = (category, float(confidence) if confidence else DEFAULT_CONFIDENCE)
+            elif len(row) == 2:
+                vendor, category = row
+                mappings[vendor.lower()] = (category, DEFAULT_CONFIDENCE)
+    return MappingProxyType(mappings)
+
+
+class VendorIndex:
+    """
+    Substring index over CSV vendor names, used for partial vendor matching
+    (a CSV vendor contained in the bill vendor, or vice versa) without
+    testing every CSV row per bill.
+    """
+
+    def __init__(self, mappings):
+        self.mappings = mappings
+        self.vendors = list(mappings)
+        self.positions = {vendor: index for index, vendor in enumerate(self.vendors)}
+        self.lengths = sorted({len(vendor) for vendor in self.vendors})
+        # All vendors joined by newlines; offsets[i] is where vendors[i] starts
+        self.haystack = '\n'.join(self.vendors)
+        self.offsets = []
+        offset = 0
+        for vendor in self.vendors:
+            self.offsets.append(offset)
+            offset += len(vendor) + 1
+
+    def _contained_in(self, vendor_lower):
+        """Indexes of CSV vendors that are substrings of vendor_lower, ascending"""
+        found = set()
+        size = len(vendor_lower)
+        for length in self.lengths:
+            if length > size:
+                break
+            for start in range(size - length + 1):
+                index = self.positions.get(vendor_lower[start:start + length])
+                if index is not None:
+                    found.add(index)
+        return sorted(found)
+
+    def _containing(self, vendor_lower):
+        """Indexes of CSV vendors that contain vendor_lower, ascending"""
+        if not vendor_lower:
+            yield from range(len(self.vendors))
+            return
+        if '\n' in vendor_lower:
+            return
+        start = 0
+        while True:
+            position = self.haystack.find(vendor_lower, start)
+            if position == -1:
+                return
+            index = bisect.bisect_right(self.offsets, position) - 1
+            yield index
+            # Continue from the next vendor; one hit per vendor is enough
+            start = self.offsets[index] + len(self.vendors[index]) + 1
+
+    def partial_matches(self, vendor_lower):
+        """Yield CSV vendors partially matching vendor_lower, in CSV order"""
+        last = None
+        for index in heapq.merge(self._contained_in(vendor_lower), self._containing(vendor_lower)):
+            if index != last:
+                last = index
+                yield self.vendors[index]
+
+
+@functools.lru_cache(maxsize=4)
+def _load_vendor_index(path, mtime_ns):
+    return VendorIndex(_load_mappings(path, mtime_ns))
+
+
+def _get_mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_vendor_mappings(path=None):
+    """Return cached vendor mappings, re-parsing only when the CSV changes on disk"""
+    path = path or get_vendor_csv_path()
+    mtime_ns = _get_mtime_ns(path)
+    if mtime_ns is None:
+        return MappingProxyType({})
+    return _load_mappings(path, mtime_ns)
+
+
+def load_vendor_index(path=None):
+    """Return the cached VendorIndex for the current contents of the CSV"""
+    path = path or get_vendor_csv_path()
+    mtime_ns = _get_mtime_ns(path)
+    if mtime_ns is None:
+        return VendorIndex(MappingProxyType({}))
+    return _load_vendor_index(path, mtime_ns)
+
+
+def clear_vendor_mappings_cache():
+    """Drop cached mappings after the CSV has been written to"""
+    _load_mappings.cache_clear()
+    _load_vendor_index.cache_clear()
@@ -4,19 +4,26 @@ from rest_framework.response import Response
 from .models import Bill, Category
 from .serializers import BillSerializer, CategorySerializer
 from .categorization_service import BillCategorizationService
+from .tasks import schedule_delete_images, schedule_process_uploaded_bill
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.views import APIView
 from rest_framework import status
-from django.db.models import Sum, Count
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum, Count, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from datetime import date, datetime, time, timedelta
 import logging
 
 logger = logging.getLogger(__name__)
 
 class IsOwner(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user
+        return obj.user_id == request.user.pk
 
 class BillViewSet(viewsets.ModelViewSet):
     serializer_class = BillSerializer
@@ -24,11 +31,66 @@ class BillViewSet(viewsets.ModelViewSet):
     parser_classes = [JSONParser, MultiPartParser, FormParser]
 
     def get_queryset(self):
-        return Bill.objects.filter(user=self.request.user).order_by("-created_at")
+        # category_name/category_color read the FK; join it instead of one query per bill
+        queryset = Bill.objects.select_related('category').filter(user=self.request.user).order_by("-created_at")
+        if self.action == 'list':
+            # Rejected duplicates only stay around until the uploader has been told
+            queryset = queryset.exclude(processing_status='DUPLICATE')
+        return queryset
+
+    def create(self, request, *args, **kwargs):
+        """Accept an upload; OCR and categorization finish in the background"""
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
 
     def perform_create(self, serializer):
-        # Categorization is now handled in the serializer
+        # Processing is queued by the serializer
         bill = serializer.save()
+
+    def perform_destroy(self, instance):
+        # Remove the stored file too, off the request path
+        with transaction.atomic():
+            image_name = instance.image.name
+            instance.delete()
+            schedule_delete_images([image_name] if image_name else [])
+    
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
+    def bulk_upload(self, request):
+        """Accept several bill files in one request; each is processed in the background"""
+        images = request.FILES.getlist('images')
+        if not images:
+            return Response({'error': 'No images provided'}, status=400)
+        
+        max_files = getattr(settings, 'MAX_BULK_UPLOAD_FILES', 20)
+        if len(images) > max_files:
+            return Response({'error': f'At most {max_files} files can be uploaded at once'}, status=400)
+        
+        # Validate every file up front so rejected ones never reach OCR
+        serializer = self.get_serializer()
+        results = []
+        new_bills = []
+        for image in images:
+            try:
+                serializer.validate_image(image)
+            except ValidationError as e:
+                results.append({'file': image.name, 'error': e.detail[0]})
+                continue
+            bill = Bill(user=request.user, image=image, processing_status='PENDING')
+            results.append({'file': image.name, 'bill': bill})
+            new_bills.append(bill)
+        
+        # One INSERT for the whole batch; processing is queued once it commits
+        with transaction.atomic():
+            Bill.objects.bulk_create(new_bills)
+            for bill in new_bills:
+                schedule_process_uploaded_bill(bill.id)
+        
+        logger.info(f"Bulk upload by {request.user.username}: {len(new_bills)} accepted, {len(images) - len(new_bills)} rejected")
+        for result in results:
+            if 'bill' in result:
+                result['bill'] = self.get_serializer(result['bill']).data
+        return Response({'results': results}, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'])
     def recategorize(self, request, pk=None):
@@ -62,26 +124,38 @@ class BillViewSet(viewsets.ModelViewSet):
             return Response({'error': 'bill_ids is required'}, status=400)
         
         categorization_service = BillCategorizationService()
-        bills = Bill.objects.filter(id__in=bill_ids, user=request.user)
+        # Stream only the columns categorization reads or writes back
+        bills = Bill.objects.filter(id__in=bill_ids, user=request.user).only(
+            'id', 'vendor', 'ocr_text', 'invoice_number', 'amount',
+            'category_id', 'is_auto_categorized', 'confidence_score', 'updated_at',
+        )
         
+        total = 0
         categorized_count = 0
-        for bill in bills:
+        to_update = []
+        for bill in bills.iterator(chunk_size=500):
+            total += 1
             try:
-                categorization_service.categorize_bill(bill)
+                categorization_service.categorize_bill(bill, commit=False)
                 categorized_count += 1
+                if bill.is_auto_categorized:
+                    to_update.append(bill)
             except Exception as e:
                 logger.error(f"Error recategorizing bill {bill.id}: {e}")
         
+        # Batched UPDATEs instead of a full save() per bill
+        categorization_service.save_categorized_bills(to_update)
+        
         return Response({
             'success': True,
             'categorized_count': categorized_count,
-            'total': len(bills)
+            'total': total
         })
     
     @action(detail=False, methods=['get'])
     def categories_summary(self, request):
         """Get bills summary by category"""
-        summary = Bill.objects.filter(user=request.user).values(
+        summary = Bill.objects.filter(user=request.user).exclude(processing_status='DUPLICATE').values(
             'category__name', 'category__type', 'category__color'
         ).annotate(
             total_amount=Sum('amount'),
@@ -93,32 +167,33 @@ class BillViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def spending_trends(self, request):
         """Monthly spending trends"""
-        from django.db.models import Q
-        from datetime import datetime, timedelta
-        import calendar
+        # The current calendar month and the 11 before it, oldest first
+        this_month = timezone.localdate().replace(day=1)
+        months = []
+        for i in range(11, -1, -1):
+            year, month = divmod(this_month.year * 12 + this_month.month - 1 - i, 12)
+            months.append(date(year, month + 1, 1))
         
-        # Get last 12 months of data
-        today = datetime.now()
-        twelve_months_ago = today - timedelta(days=365)
+        # One grouped query instead of one aggregate per month
+        first_month_start = timezone.make_aware(datetime.combine(months[0], time.min))
+        monthly_totals = Bill.objects.filter(
+            user=request.user,
+            created_at__gte=first_month_start,
+            amount__isnull=False
+        ).annotate(month=TruncMonth('created_at')).values('month').annotate(
+            total=Sum('amount')
+        ).order_by()
+        totals_by_month = {row['month'].date(): row['total'] for row in monthly_totals}
         
         monthly_data = []
-        for i in range(12):
-            month_start = datetime(today.year, today.month, 1) - timedelta(days=30*i)
-            month_end = month_start.replace(day=calendar.monthrange(month_start.year, month_start.month)[1])
-            
-            monthly_total = Bill.objects.filter(
-                user=request.user,
-                created_at__range=[month_start, month_end],
-                amount__isnull=False
-            ).aggregate(total=Sum('amount'))['total'] or 0
-            
+        for month_start in months:
             monthly_data.append({
                 'month': month_start.strftime('%Y-%m'),
                 'month_name': month_start.strftime('%B %Y'),
-                'total': float(monthly_total)
+                'total': float(totals_by_month.get(month_start) or 0)
             })
         
-        return Response(monthly_data[::-1])  # Reverse to show oldest first
+        return Response(monthly_data)
     
     @action(detail=False, methods=['get'])
     def top_vendors(self, request):
@@ -137,38 +212,25 @@ class BillViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def dashboard_stats(self, request):
         """Dashboard overview statistics"""
-        from datetime import datetime, timedelta
-        
-        today = datetime.now()
-        this_month_start = today.replace(day=1)
-        last_month_start = (this_month_start - timedelta(days=1)).replace(day=1)
+        this_month = timezone.localdate().replace(day=1)
+        last_month = (this_month - timedelta(days=1)).replace(day=1)
+        this_month_start = timezone.make_aware(datetime.combine(this_month, time.min))
+        last_month_start = timezone.make_aware(datetime.combine(last_month, time.min))
         
-        # Current month stats
-        this_month_total = Bill.objects.filter(
-            user=request.user,
-            created_at__gte=this_month_start,
-            amount__isnull=False
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Last month stats  
-        last_month_total = Bill.objects.filter(
-            user=request.user,
-            created_at__range=[last_month_start, this_month_start],
-            amount__isnull=False
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Total stats
-        total_bills = Bill.objects.filter(user=request.user).count()
-        total_spent = Bill.objects.filter(
-            user=request.user,
-            amount__isnull=False
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Categorized vs uncategorized
-        categorized_count = Bill.objects.filter(
-            user=request.user,
-            category__isnull=False
-        ).count()
+        # All figures from one pass over the user's bills; SUM skips null amounts.
+        # Rejected duplicates are left out, as in the bill list
+        stats = Bill.objects.filter(user=request.user).exclude(processing_status='DUPLICATE').aggregate(
+            this_month_total=Sum('amount', filter=Q(created_at__gte=this_month_start)),
+            last_month_total=Sum('amount', filter=Q(created_at__gte=last_month_start, created_at__lt=this_month_start)),
+            total_bills=Count('id'),
+            total_spent=Sum('amount'),
+            categorized_count=Count('id', filter=Q(category__isnull=False))
+        )
+        this_month_total = stats['this_month_total'] or 0
+        last_month_total = stats['last_month_total'] or 0
+        total_bills = stats['total_bills']
+        total_spent = stats['total_spent'] or 0
+        categorized_count = stats['categorized_count']
         
         uncategorized_count = total_bills - categorized_count
         
@@ -196,16 +258,13 @@ class BillViewSet(viewsets.ModelViewSet):
         if not bill_ids:
             return Response({'error': 'No bill IDs provided'}, status=400)
         
-        deleted_count = 0
-        for bill_id in bill_ids:
-            try:
-                bill = Bill.objects.get(id=bill_id, user=request.user)
-                if bill.image:
-                    bill.image.delete()
-                bill.delete()
-                deleted_count += 1
-            except Bill.DoesNotExist:
-                continue
+        # One DELETE for the rows; files are removed off the request path
+        bills = Bill.objects.filter(id__in=bill_ids, user=request.user)
+        with transaction.atomic():
+            image_names = [name for name in bills.values_list('image', flat=True) if name]
+            _, deleted = bills.delete()
+            schedule_delete_images(image_names)
+        deleted_count = deleted.get(Bill._meta.label, 0)
         
         return Response({'deleted_count': deleted_count})
 
@@ -213,3 +272,14 @@ class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        """Annotate the user's per-category bill stats in the same SELECT as the categories"""
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve') and self.request.user.is_authenticated:
+            user_bills = Q(bill__user=self.request.user)
+            queryset = queryset.annotate(
+                bill_count=Count('bill', filter=user_bills),
+                total_amount=Sum('bill__amount_npr', filter=user_bills)
+            )
+        return queryset
@@ -0,0 +1,29 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # Fall back to DRF's stdlib json renderer
+    orjson = None
+
+
+class OrjsonRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson. Types orjson doesn't handle natively
+    (Decimal, QuerySet, lazy strings, datetimes) are encoded exactly as
+    DRF's JSONEncoder would encode them.
+    """
+    _default = staticmethod(JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if data is None:
+            return b''
+
+        return orjson.dumps(
+            data,
+            default=self._default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
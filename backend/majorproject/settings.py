@@ -83,6 +83,21 @@ DATABASES = {
         "PASSWORD": os.environ.get("DB_PASSWORD", ""),
         "HOST": os.environ.get("DB_HOST", ""),
         "PORT": os.environ.get("DB_PORT", ""),
+        # Reuse connections across requests instead of reconnecting every time
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "60")),
+        "CONN_HEALTH_CHECKS": True,
+    }
+}
+
+# -----------------------
+# CACHE (env-friendly)
+# -----------------------
+# Per-process memory by default; point at a shared backend (e.g. redis or
+# database cache) so OCR results are reused across server processes
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
     }
 }
 
@@ -96,6 +111,16 @@ AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.NumericPasswordValidator"},
 ]
 
+# Argon2id first; existing PBKDF2 hashes are upgraded on the next successful login
+PASSWORD_HASHERS = [
+    "accounts.hashers.TunedArgon2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
 # -----------------------
 # INTERNATIONALIZATION
 # -----------------------
@@ -135,7 +160,7 @@ REST_FRAMEWORK = {
         "rest_framework.parsers.MultiPartParser",
     ],
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
+        "majorproject.renderers.OrjsonRenderer",
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.LimitOffsetPagination",
     "PAGE_SIZE": 20,
@@ -175,6 +200,10 @@ MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 10 * 1024 * 1024))  # 10
 ALLOWED_UPLOAD_TYPES = os.environ.get(
     "ALLOWED_UPLOAD_TYPES", "image/jpeg,image/png,image/webp,application/pdf"
 ).split(",")
+# Files accepted by one bulk upload request
+MAX_BULK_UPLOAD_FILES = int(os.environ.get("MAX_BULK_UPLOAD_FILES", 20))
+# Concurrent background OCR jobs per server process
+BILL_PROCESSING_WORKERS = int(os.environ.get("BILL_PROCESSING_WORKERS", 2))
 
 # -----------------------
 # EMAIL (console default - change for prod)
@@ -1,8 +1,37 @@
 import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 
 def save_to_excel(data, file_path ="invoices.xlsx"):
 
     df = pd.DataFrame(data)
     df.to_excel(file_path, index=False)
-    return file_path
\ No newline at end of file
+    return file_path
+
+
+class ExcelRowWriter:
+    """Stream rows into a write-only workbook that is saved once at the end"""
+
+    def __init__(self, file_path="invoices.xlsx"):
+        self.file_path = file_path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.columns = None
+
+    def append(self, row):
+        # The first row's keys become the header, as with save_to_excel
+        if self.columns is None:
+            self.columns = list(row)
+            self.sheet.append(self.columns)
+        # A rejected cell would break the write-only sheet for every later row,
+        # so drop control characters (common in OCR output) up front
+        self.sheet.append([
+            ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value
+            for value in (row.get(column) for column in self.columns)
+        ])
+
+    def save(self):
+        if self.columns is None:
+            return None
+        self.workbook.save(self.file_path)
+        return self.file_path
@@ -9,6 +9,10 @@ from datetime import datetime
 import difflib
 from nepali_datetime import date as NepaliDate
 
+# Pages are OCR'd in parallel by the upload worker pool and process_ocr's
+# processes; Tesseract's own OpenMP threads would only oversubscribe the CPUs
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
 # Advanced OCR patterns for data extraction - Enhanced for Indian GST invoices
 AMOUNT_PATTERNS = [
     r'total\s*amount\s*:?\s*[$₹]?\s*(\d+(?:,\d{3})*\.?\d*)',  # Total Amount : 38026.00
@@ -38,6 +42,26 @@ DATE_PATTERNS = [
     r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{2,4})',
 ]
 
+# Invoice number patterns, compiled once at import since they run for every bill
+INVOICE_NUMBER_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'invoice\s+no\.?\s*[>:]\s*([a-zA-Z0-9\-_/.]+)',  # Invoice No. > BSB.O111 or Invoice No: ABC123
+    r'invoice\s+number\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # Invoice Number: INV-12345 (with flexible whitespace)
+    r'bill\s*no\.?\s*[>:]?\s*([a-zA-Z0-9\-_/.]+)',  # Bill No 1 or Bill No: 1 or Bill No. > 123
+    r'invoice\s*#\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # INVOICE # us-001
+    r'inv\.?\s*no\.?\s*[>:]?\s*([a-zA-Z0-9\-_/.]+)',  # Inv. No. : Inv-5 or Inv No > 123
+    r'invoice\s*(?:no|num)\.?\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # Invoice No: ABC123 or Invoice No.
+    r'bill\s*(?:number|#)\.?\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # Bill Number: 12345
+    r'#\s*:?\s*([a-zA-Z]{2,}-?\d+)',  # # US-001 or #: us-001
+    r'invoice\s*:?\s*([a-zA-Z0-9]{3,}(?:[\-_/.][a-zA-Z0-9]+)?)',  # Invoice: INV001
+    # Fallback: Look for "Bill" followed by standalone number on same or next line
+    r'bill[^\n]{0,30}?(\d{1,6})',  # Bill ... 123
+)]
+
+# Common words that are NOT invoice numbers (to filter out false positives)
+INVOICE_NUMBER_BLACKLIST = frozenset(['date', 'ltd', 'limited', 'inc', 'corp', 'pvt', 'llc', 'company', 'co'])
+
+WHITESPACE_RE = re.compile(r'\s+')
+
 VENDOR_INDICATORS = [
     'store', 'market', 'shop', 'restaurant', 'cafe', 'gas', 'pharmacy',
     'hospital', 'clinic', 'hotel', 'airline', 'taxi', 'uber', 'lyft'
@@ -105,23 +129,40 @@ def process_bill_image(image_file):
         # Extract raw text
         raw_text = extract_text_from_image(image_file)
         
-        # Process with advanced OCR functions
-        structured_data = extract_bill_data(raw_text)
+        return build_bill_data(raw_text)
         
-        # Return both raw text and processed data
-        return {
-            'ocr_text': raw_text,
-            'vendor': structured_data.get('vendor'),
-            'amount': structured_data.get('amount'),
-            'tax_amount': structured_data.get('tax_amount'),
-            'bill_date': structured_data.get('bill_date'),
-            'invoice_number': structured_data.get('invoice_number'),
-            'line_items': structured_data.get('line_items', [])
-        }
+    except Exception as e:
+        raise Exception(f"Error processing bill image: {str(e)}")
+
+def process_bill_image_bytes(file_bytes, filename):
+    """
+    Same as process_bill_image, for file contents already read into memory;
+    filename only selects the format (PDF or image)
+    """
+    try:
+        raw_text = extract_text_from_bytes(file_bytes, filename)
+        
+        return build_bill_data(raw_text)
         
     except Exception as e:
         raise Exception(f"Error processing bill image: {str(e)}")
 
+def build_bill_data(raw_text):
+    """Structured data ready for the Bill model, from raw OCR text"""
+    # Process with advanced OCR functions
+    structured_data = extract_bill_data(raw_text)
+    
+    # Return both raw text and processed data
+    return {
+        'ocr_text': raw_text,
+        'vendor': structured_data.get('vendor'),
+        'amount': structured_data.get('amount'),
+        'tax_amount': structured_data.get('tax_amount'),
+        'bill_date': structured_data.get('bill_date'),
+        'invoice_number': structured_data.get('invoice_number'),
+        'line_items': structured_data.get('line_items', [])
+    }
+
 def extract_bill_data(ocr_text):
     """Extract structured data from OCR text - Enhanced"""
     text_lower = ocr_text.lower()
@@ -494,36 +535,19 @@ def parse_item_line(line):
 
 def extract_invoice_number(text):
     """Extract invoice/bill number - improved for various formats"""
-    patterns = [
-        r'invoice\s+no\.?\s*[>:]\s*([a-zA-Z0-9\-_/.]+)',  # Invoice No. > BSB.O111 or Invoice No: ABC123
-        r'invoice\s+number\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # Invoice Number: INV-12345 (with flexible whitespace)
-        r'bill\s*no\.?\s*[>:]?\s*([a-zA-Z0-9\-_/.]+)',  # Bill No 1 or Bill No: 1 or Bill No. > 123
-        r'invoice\s*#\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # INVOICE # us-001
-        r'inv\.?\s*no\.?\s*[>:]?\s*([a-zA-Z0-9\-_/.]+)',  # Inv. No. : Inv-5 or Inv No > 123
-        r'invoice\s*(?:no|num)\.?\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # Invoice No: ABC123 or Invoice No.
-        r'bill\s*(?:number|#)\.?\s*:?\s*([a-zA-Z0-9\-_/.]+)',  # Bill Number: 12345
-        r'#\s*:?\s*([a-zA-Z]{2,}-?\d+)',  # # US-001 or #: us-001
-        r'invoice\s*:?\s*([a-zA-Z0-9]{3,}(?:[\-_/.][a-zA-Z0-9]+)?)',  # Invoice: INV001
-        # Fallback: Look for "Bill" followed by standalone number on same or next line
-        r'bill[^\n]{0,30}?(\d{1,6})',  # Bill ... 123
-    ]
-    
-    # Common words that are NOT invoice numbers (to filter out false positives)
-    blacklist = ['date', 'ltd', 'limited', 'inc', 'corp', 'pvt', 'llc', 'company', 'co']
-    
-    for i, pattern in enumerate(patterns):
-        match = re.search(pattern, text, re.IGNORECASE)
+    for i, pattern in enumerate(INVOICE_NUMBER_PATTERNS):
+        match = pattern.search(text)
         if match:
             inv_num = match.group(1).strip()
             # Remove extra whitespace
-            inv_num = re.sub(r'\s+', '', inv_num)
+            inv_num = WHITESPACE_RE.sub('', inv_num)
             
             # Check if it's in the blacklist
-            if inv_num.lower() in blacklist:
+            if inv_num.lower() in INVOICE_NUMBER_BLACKLIST:
                 continue
             
             # For fallback pattern (last one), be more strict - avoid dates
-            if i == len(patterns) - 1:
+            if i == len(INVOICE_NUMBER_PATTERNS) - 1:
                 # Skip if it looks like a date (4+ digits or contains separators)
                 if len(inv_num) >= 4 or '-' in inv_num or '/' in inv_num:
                     continue
@@ -623,8 +647,20 @@ def categorize_bill(bill_data, categories):
     confidence = min(highest_score / 5.0, 1.0)  # Normalize to 0-1
     return best_match, confidence
 
+def extract_text_from_bytes(file_bytes, filename):
+    """
+    Extract text from an in-memory image or PDF using OCR
+    """
+    try:
+        if os.path.splitext(filename)[1].lower() == '.pdf':
+            return extract_text_from_pdf(file_bytes)
+        return extract_text_from_image_file(io.BytesIO(file_bytes))
+    
+    except Exception as e:
+        raise Exception(f"Error extracting text from file: {str(e)}")
+
 def extract_text_from_image_file(image_path):
-    """Extract text from image files using OCR"""
+    """Extract text from image files using OCR (a path or a file object)"""
     try:
         # Open the image file
         image = Image.open(image_path)
@@ -641,11 +677,17 @@ def extract_text_from_image_file(image_path):
     except Exception as e:
         raise Exception(f"Error extracting text from image: {str(e)}")
 
+def open_pdf(pdf_source):
+    """Open a PDF from a path or from its raw bytes"""
+    if isinstance(pdf_source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=pdf_source, filetype='pdf')
+    return fitz.open(pdf_source)
+
 def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF files using PyMuPDF"""
+    """Extract text from PDF files using PyMuPDF (a path or the file's bytes)"""
     try:
         # Open PDF document
-        doc = fitz.open(pdf_path)
+        doc = open_pdf(pdf_path)
         extracted_text = ""
         
         # Extract text from each page
@@ -672,7 +714,7 @@ def extract_text_from_pdf(pdf_path):
 def extract_text_from_pdf_with_ocr(pdf_path):
     """Extract text from PDF using OCR (for scanned PDFs)"""
     try:
-        doc = fitz.open(pdf_path)
+        doc = open_pdf(pdf_path)
         extracted_text = ""
         
         for page_num in range(min(3, len(doc))):  # Process max 3 pages for performance
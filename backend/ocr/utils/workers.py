@@ -0,0 +1,28 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from .ocr_processor import extract_text_from_image, process_bill_image
+
+# Pool workers unpickle their task functions by importing this module, so it
+# must not import Django models: spawned workers never run django.setup()
+
+
+def create_ocr_pool(max_workers=None):
+    """Process pool for the OCR management commands, started the same way on every platform"""
+    # Spawn rather than fork so workers don't inherit the parent's DB connections
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def extract_text_with_error(path):
+    """Run OCR in a worker process, returning (text, error) instead of raising"""
+    try:
+        return extract_text_from_image(path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def extract_line_items_with_error(path):
+    """Re-process a bill image in a worker process, returning (line_items, error)"""
+    try:
+        return process_bill_image(path).get('line_items', []), None
+    except Exception as e:
+        return None, str(e)
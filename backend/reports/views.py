@@ -48,7 +48,7 @@ class ReportViewSet(viewsets.ModelViewSet):
         bills_query = Bill.objects.filter(
             user=request.user,
             created_at__date__range=[start_date, end_date]
-        )
+        ).exclude(processing_status='DUPLICATE')
         
         # Apply filters
         if data.get('categories'):
@@ -101,7 +101,7 @@ class ReportViewSet(viewsets.ModelViewSet):
         bills_query = Bill.objects.filter(
             user=request.user,
             created_at__date__range=[start_date, end_date]
-        )
+        ).exclude(processing_status='DUPLICATE')
         
         report_data = list(bills_query.values(
             'category__name', 'category__type'
@@ -145,7 +145,7 @@ class ReportViewSet(viewsets.ModelViewSet):
             monthly_bills = Bill.objects.filter(
                 user=request.user,
                 created_at__date__range=[month_start, month_end]
-            ).count()
+            ).exclude(processing_status='DUPLICATE').count()
             
             monthly_data.append({
                 'month': month,
@@ -518,7 +518,7 @@ class TransactionExportView(APIView):
         start_date_str = request.query_params.get('start_date')
         end_date_str = request.query_params.get('end_date')
         
-        bills = Bill.objects.filter(user=request.user).order_by('bill_date')
+        bills = Bill.objects.filter(user=request.user).exclude(processing_status='DUPLICATE').order_by('bill_date')
         
         if start_date_str and end_date_str:
             try:
@@ -101,6 +101,31 @@ const Upload = () => {
     }
   };
 
+  // Poll an accepted upload until background OCR finishes.
+  // Resolves to the bill's processing_status, or 'DUPLICATE' if the server removed it.
+  // A rejected duplicate is deleted here, once its status has been read.
+  const waitForProcessing = async (billId) => {
+    for (let attempt = 0; attempt < 90; attempt++) {
+      try {
+        const response = await api.get(`/bills/${billId}/`);
+        if (response.data.processing_status === 'DUPLICATE') {
+          await api.delete(`/bills/${billId}/`).catch(() => {});
+          return 'DUPLICATE';
+        }
+        if (response.data.processing_status !== 'PENDING') {
+          return response.data.processing_status;
+        }
+      } catch (error) {
+        if (error.response?.status === 404) {
+          return 'DUPLICATE';
+        }
+        throw error;
+      }
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+    }
+    return 'PENDING';
+  };
+
   const handleUpload = async () => {
     if (files.length === 0) {
       toast.error('Please select at least one file');
@@ -112,37 +137,56 @@ const Upload = () => {
       setUploadProgress(0);
       let successCount = 0;
       let failCount = 0;
+      const accepted = [];
 
-      // Upload files one by one
-      for (let i = 0; i < files.length; i++) {
-        const file = files[i];
-        try {
-          const formData = new FormData();
-          formData.append('image', file);
+      // Upload all files in one request; the server validates each one
+      try {
+        const formData = new FormData();
+        files.forEach((file) => formData.append('images', file));
 
-          const response = await api.post('/bills/', formData);
+        const response = await api.post('/bills/bulk_upload/', formData, {
+          onUploadProgress: (event) => {
+            if (event.total) {
+              setUploadProgress((event.loaded / event.total) * 100);
+            }
+          },
+        });
 
-          if (response.status === 201) {
-            successCount++;
+        response.data.results.forEach((result, i) => {
+          if (result.bill) {
+            accepted.push({ file: files[i], billId: result.bill.id });
+          } else {
+            failCount++;
+            toast.error(`${files[i].name}: ${result.error}`);
           }
-          
-          // Update progress
-          setUploadProgress(((i + 1) / files.length) * 100);
-        } catch (error) {
-          console.error(`Upload error for ${file.name}:`, error);
+        });
+      } catch (error) {
+        console.error('Upload error:', error);
+        failCount += files.length;
+        const serverMessage = error.response?.data?.error || 
+                             error.response?.data?.detail || 
+                             error.message || 
+                             'Error uploading files';
+        toast.error(serverMessage);
+      }
+
+      // Wait for OCR on every accepted upload
+      const outcomes = await Promise.all(accepted.map(({ file, billId }) =>
+        waitForProcessing(billId)
+          .then((processingStatus) => ({ file, processingStatus }))
+          .catch(() => ({ file, processingStatus: 'PENDING' }))
+      ));
+
+      for (const { file, processingStatus } of outcomes) {
+        if (processingStatus === 'DUPLICATE') {
           failCount++;
-          
-          // Handle duplicate bill error
-          if (error.response?.data?.error === 'Duplicate bill detected') {
-            toast.warning(`${file.name}: ${error.response.data.message}`);
-          } else {
-            // Handle other errors
-            const serverMessage = error.response?.data?.image?.[0] || 
-                                 error.response?.data?.message || 
-                                 error.response?.data?.detail || 
-                                 error.message || 
-                                 'Error uploading file';
-            toast.error(`${file.name}: ${serverMessage}`);
+          toast.warning(`${file.name}: This bill already exists`);
+        } else {
+          successCount++;
+          if (processingStatus === 'FAILED') {
+            toast.warning(`${file.name}: Uploaded, but text could not be extracted`);
+          } else if (processingStatus === 'PENDING') {
+            toast.info(`${file.name}: Uploaded, still processing in the background`);
           }
         }
       }